@@ -0,0 +1,307 @@
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import manifest
+from db import init_db, list_invoices, count_invoices, get_invoice, update_invoice_status
+from storage import get_storage
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_PER_PAGE = 500
+CHUNK_SIZE = 256 * 1024
+INVOICE_FIELDS = ("id", "number", "name", "date", "status", "folder")
+STATUSES = ("completo", "incompleto")
+
+_REASONS = {
+    200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+    404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or _REASONS.get(status, "")
+
+
+def _invoice_dict(row):
+    return dict(zip(INVOICE_FIELDS, row))
+
+
+def _etag(size, mtime_ns):
+    """ETag fuerte derivada del tamaño y el mtime del PDF."""
+    return f'"{size:x}-{mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Interpreta una cabecera Range de un único rango en bytes. Devuelve (inicio, fin) inclusivos,
+    None si no hay rango aplicable, o lanza HTTPError(416) si no es satisfacible.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # bytes=-N: los últimos N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPError(416)
+    return start, end
+
+
+class InvoiceAPI:
+    """
+    Servicio HTTP local (asyncio) sobre db.py y el almacenamiento de PDFs.
+    Las llamadas a SQLite y al disco se ejecutan en un pequeño pool de hilos para no bloquear el bucle.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="invoice-api")
+        self.server = None
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    # ===== HTTP =====
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.send_json(writer, 400, {"error": "Bad Request"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # Sin una longitud válida no se sabe dónde acaba el cuerpo: se cierra la conexión
+                    await self.send_json(writer, 400, {"error": "Content-Length no válido"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    await self.dispatch(writer, method, target, headers, body, keep_alive)
+                except HTTPError as e:
+                    await self.send_json(writer, e.status, {"error": e.message}, keep_alive=keep_alive)
+                except Exception as e:
+                    await self.send_json(writer, 500, {"error": str(e)}, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, headers, body=b"", keep_alive=True):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        headers = dict(headers)
+        headers.setdefault("Content-Length", str(len(body)))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def send_json(self, writer, status, data, keep_alive=True):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        await self.send(writer, status, {"Content-Type": "application/json; charset=utf-8"}, body, keep_alive)
+
+    async def dispatch(self, writer, method, target, headers, body, keep_alive):
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip("/").split("/") if p]
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if parts == ["invoices"] and method == "GET":
+            data = await self.list_invoices(params)
+            return await self.send_json(writer, 200, data, keep_alive)
+        if len(parts) == 2 and parts[0] == "invoices" and method == "GET":
+            data = await self.invoice_detail(parts[1])
+            return await self.send_json(writer, 200, data, keep_alive)
+        if len(parts) == 3 and parts[0] == "invoices" and parts[2] == "status":
+            if method not in ("PUT", "PATCH", "POST"):
+                raise HTTPError(405)
+            data = await self.set_status(parts[1], body)
+            return await self.send_json(writer, 200, data, keep_alive)
+        if len(parts) == 3 and parts[0] == "invoices" and parts[2] == "pdfs" and method == "GET":
+            invoice = await self.find_invoice(parts[1])
+            data = await self.run_blocking(self.attachments, invoice["folder"])
+            return await self.send_json(writer, 200, data, keep_alive)
+        if len(parts) == 4 and parts[0] == "invoices" and parts[2] == "pdfs":
+            if method not in ("GET", "HEAD"):
+                raise HTTPError(405)
+            return await self.send_pdf(writer, method, parts[1], parts[3], headers, keep_alive)
+        raise HTTPError(404)
+
+    # ===== Endpoints =====
+
+    async def list_invoices(self, params):
+        try:
+            page = max(int(params.get("page", 1)), 1)
+            per_page = min(max(int(params.get("per_page", 50)), 1), MAX_PER_PAGE)
+        except ValueError:
+            raise HTTPError(400, "page y per_page deben ser enteros")
+        filters = {
+            "year": params.get("year"),
+            "status": params.get("status"),
+            "date_from": params.get("from"),
+            "date_to": params.get("to"),
+            "query": params.get("q"),
+        }
+        total = await self.run_blocking(lambda: count_invoices(**filters))
+        rows = await self.run_blocking(lambda: list_invoices(per_page, (page - 1) * per_page, **filters))
+        return {"page": page, "per_page": per_page, "total": total,
+                "items": [_invoice_dict(r) for r in rows]}
+
+    async def find_invoice(self, number):
+        row = await self.run_blocking(get_invoice, number)
+        if row is None:
+            raise HTTPError(404, f"Factura '{number}' no encontrada")
+        return _invoice_dict(row)
+
+    async def invoice_detail(self, number):
+        invoice = await self.find_invoice(number)
+        invoice["pdfs"] = await self.run_blocking(self.attachments, invoice["folder"])
+        return invoice
+
+    async def set_status(self, number, body):
+        try:
+            status = json.loads(body or b"{}").get("status")
+        except (ValueError, AttributeError):
+            raise HTTPError(400, "El cuerpo debe ser JSON")
+        if status not in STATUSES:
+            raise HTTPError(400, f"status debe ser uno de {', '.join(STATUSES)}")
+        await self.find_invoice(number)
+        await self.run_blocking(update_invoice_status, number, status)
+        return await self.find_invoice(number)
+
+    @staticmethod
+    def attachments(folder):
+        entries, _ = manifest.refresh_folder(folder)
+        return [{"filename": e["filename"], "size": e["size"], "pages": e["pages"],
+                 "etag": _etag(e["size"], e["mtime_ns"])} for e in entries]
+
+    @staticmethod
+    def open_pdf(folder, filename):
+        """Abre el PDF y devuelve (archivo, tamaño, mtime_ns); sólo sirve archivos listados en la carpeta."""
+        storage = get_storage()
+        for name, size, mtime_ns in storage.list(folder):
+            if name == filename:
+                path = storage.path(folder, filename) or storage.local_path(folder, filename)
+                return open(path, "rb"), size, mtime_ns
+        raise HTTPError(404, f"PDF '{filename}' no encontrado")
+
+    async def send_pdf(self, writer, method, number, filename, headers, keep_alive):
+        invoice = await self.find_invoice(number)
+        f, size, mtime_ns = await self.run_blocking(self.open_pdf, invoice["folder"], filename)
+        try:
+            etag = _etag(size, mtime_ns)
+            base_headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(mtime_ns / 1e9, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Cache-Control": "private, no-cache",
+            }
+            if etag in [t.strip() for t in headers.get("if-none-match", "").split(",")]:
+                return await self.send(writer, 304, base_headers, keep_alive=keep_alive)
+
+            byte_range = None
+            if_range = headers.get("if-range")
+            if not if_range or if_range == etag:
+                try:
+                    byte_range = parse_range(headers.get("range"), size)
+                except HTTPError:
+                    base_headers["Content-Range"] = f"bytes */{size}"
+                    return await self.send(writer, 416, base_headers, keep_alive=keep_alive)
+
+            if byte_range:
+                start, end = byte_range
+                status = 206
+                base_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            else:
+                start, end, status = 0, size - 1, 200
+            length = end - start + 1
+            base_headers["Content-Type"] = "application/pdf"
+            base_headers["Content-Length"] = str(length)
+            await self.send(writer, status, base_headers, keep_alive=keep_alive)
+            if method == "HEAD":
+                return
+
+            await self.run_blocking(f.seek, start)
+            remaining = length
+            while remaining > 0:
+                chunk = await self.run_blocking(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+                remaining -= len(chunk)
+        finally:
+            f.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_workers=4):
+    api = InvoiceAPI(max_workers)
+    server = await api.start(host, port)
+    print(f"Invoice API escuchando en http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP local del catálogo de facturas.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=4, help="Hilos para SQLite y disco")
+    args = parser.parse_args(argv)
+    init_db()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import sys
+import mmap
+import time
+import shutil
+import struct
+import zipfile
+import tempfile
+import threading
+import argparse
+
+DATA_DIR = "data"
+PACK_EXT = ".zip"
+
+# Cabecera local de un miembro zip: firma, versiones, flags, ..., longitud de nombre y de extra
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def pack_path(year):
+    """Ruta del paquete de un año archivado (data/<año>.zip)."""
+    return os.path.join(DATA_DIR, f"{year}{PACK_EXT}")
+
+
+def is_archived(year):
+    """Un año está archivado si existe su paquete y no su carpeta."""
+    return os.path.isfile(pack_path(year)) and not os.path.isdir(os.path.join(DATA_DIR, str(year)))
+
+
+def split_folder(folder):
+    """Separa data/<año>/<número> en (año, número), o (None, None) si no sigue esa estructura."""
+    parts = os.path.normpath(folder).split(os.sep)
+    if len(parts) >= 3 and parts[-3] == DATA_DIR:
+        return parts[-2], parts[-1]
+    return None, None
+
+
+def archived_year_of(folder):
+    """Devuelve (año, número) si la carpeta de factura pertenece a un año archivado, si no (None, None)."""
+    year, number = split_folder(folder)
+    if year is not None and is_archived(year):
+        return year, number
+    return None, None
+
+
+class PackReader:
+    """
+    Lector de un paquete de año. Sólo lee el directorio central del zip para construir
+    el índice; el contenido de cada PDF se obtiene como un corte del archivo mapeado en memoria.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._zip = zipfile.ZipFile(self._file)
+        self._zip_lock = threading.Lock()
+        self.index = {}  # número -> {archivo: ZipInfo}
+        for info in self._zip.infolist():
+            number, _, filename = info.filename.partition("/")
+            files = self.index.setdefault(number, {})
+            if filename and not info.is_dir():
+                files[filename] = info
+
+    def close(self):
+        self._zip.close()
+        self._map.close()
+        self._file.close()
+
+    def numbers(self):
+        return list(self.index)
+
+    def list_files(self, number):
+        """Devuelve [(archivo, tamaño, mtime_ns)] de una factura del paquete."""
+        return [
+            (name, info.file_size, int(time.mktime(info.date_time + (0, 0, -1))) * 10**9)
+            for name, info in self.index.get(number, {}).items()
+        ]
+
+    def _data_offset(self, info):
+        header = _LOCAL_HEADER.unpack_from(self._map, info.header_offset)
+        if header[0] != _LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Cabecera local corrupta en {info.filename}")
+        name_len, extra_len = header[-2], header[-1]
+        return info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+    def read(self, number, filename):
+        """Lee un PDF del paquete sin extraer el resto."""
+        info = self.index.get(number, {}).get(filename)
+        if info is None:
+            raise FileNotFoundError(f"{number}/{filename} no está en {self.path}")
+        if info.compress_type == zipfile.ZIP_STORED:
+            start = self._data_offset(info)
+            return self._map[start:start + info.file_size]
+        # Miembros comprimidos (paquetes creados fuera de la aplicación)
+        with self._zip_lock:
+            return self._zip.read(info)
+
+
+def open_pack(year):
+    """Devuelve un PackReader compartido para el año, reabriéndolo si el paquete ha cambiado."""
+    path = pack_path(year)
+    with _readers_lock:
+        reader = _readers.get(path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if reader is not None and reader.mtime_ns != mtime_ns:
+            _readers.pop(path).close()
+            reader = None
+        if reader is None:
+            if mtime_ns is None:
+                raise FileNotFoundError(path)
+            reader = _readers[path] = PackReader(path)
+        return reader
+
+
+def close_pack(year):
+    with _readers_lock:
+        reader = _readers.pop(pack_path(year), None)
+        if reader is not None:
+            reader.close()
+
+
+def materialize(folder, filename):
+    """
+    Copia un único PDF de un paquete a la caché temporal y devuelve su ruta,
+    para los consumidores que necesitan un archivo (visor PDF.js, visor del sistema).
+    La copia lleva el mtime del paquete: si el paquete se rehace, se vuelve a extraer
+    aunque el PDF tenga el mismo tamaño.
+    """
+    year, number = archived_year_of(folder)
+    if year is None:
+        return os.path.join(folder, filename)
+    reader = open_pack(year)
+    cache_dir = os.path.join(tempfile.gettempdir(), "invoice_manager_packs", year, number)
+    path = os.path.join(cache_dir, filename)
+    info = reader.index.get(number, {}).get(filename)
+    if info is None:
+        raise FileNotFoundError(f"{number}/{filename} no está en el paquete {year}")
+    try:
+        st = os.stat(path)
+        fresh = st.st_size == info.file_size and st.st_mtime_ns == reader.mtime_ns
+    except OSError:
+        fresh = False
+    if not fresh:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(reader.read(number, filename))
+        os.utime(path + ".part", ns=(reader.mtime_ns, reader.mtime_ns))
+        os.replace(path + ".part", path)
+    return path
+
+
+def _packable(rel_parts):
+    """El paquete sólo guarda los PDFs que están directamente en la carpeta de cada factura."""
+    return len(rel_parts) == 2 and rel_parts[1].lower().endswith(".pdf")
+
+
+def _walk_year(year_folder):
+    """
+    Recorre data/<año> y devuelve ({"número/archivo": tamaño} de lo que se empaqueta, números de factura,
+    [rutas relativas de lo que el paquete no guardaría]).
+    """
+    files, numbers, extra = {}, set(), []
+    for root, dirs, names in os.walk(year_folder):
+        rel_root = os.path.relpath(root, year_folder)
+        parts = [] if rel_root == "." else rel_root.split(os.sep)
+        if len(parts) == 1:
+            numbers.add(parts[0])
+        elif len(parts) > 1:
+            extra.append("/".join(parts) + "/")
+        for name in names:
+            rel_parts = parts + [name]
+            if _packable(rel_parts):
+                files["/".join(rel_parts)] = os.path.getsize(os.path.join(root, name))
+            else:
+                extra.append("/".join(rel_parts))
+    return files, numbers, sorted(extra)
+
+
+def pack_year(year, remove_folders=True):
+    """
+    Empaqueta data/<año> en data/<año>.zip sin compresión (los PDFs ya lo están y así
+    cada miembro es accesible directamente en el mapa de memoria). Verifica el paquete
+    antes de borrar las carpetas. Devuelve el número de PDFs empaquetados.
+    Si hay algo que el paquete no guarda (otros archivos, subcarpetas, archivos sueltos en el año),
+    no se archiva nada salvo con remove_folders=False, que sólo empaqueta y conserva las carpetas.
+    """
+    year = str(year)
+    year_folder = os.path.join(DATA_DIR, year)
+    if not os.path.isdir(year_folder):
+        raise FileNotFoundError(f"No existe la carpeta {year_folder}")
+    expected, numbers, extra = _walk_year(year_folder)
+    if remove_folders and extra:
+        shown = ", ".join(extra[:10]) + (" ..." if len(extra) > 10 else "")
+        raise ValueError(f"{year_folder} contiene {len(extra)} elementos que el paquete no guarda: {shown}")
+    path = pack_path(year)
+    tmp_path = path + ".part"
+    count = 0
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for number in sorted(numbers):
+            # Entrada de directorio para que las facturas sin PDFs sigan apareciendo
+            zf.writestr(zipfile.ZipInfo(f"{number}/"), b"")
+        for name in sorted(expected):
+            zf.write(os.path.join(year_folder, *name.split("/")), name)
+            count += 1
+    with zipfile.ZipFile(tmp_path) as zf:
+        bad = zf.testzip()
+        packed = {info.filename: info.file_size for info in zf.infolist() if not info.is_dir()}
+    if bad is not None:
+        os.remove(tmp_path)
+        raise zipfile.BadZipFile(f"Error verificando {bad} en el paquete {year}")
+    close_pack(year)
+    os.replace(tmp_path, path)
+    if remove_folders:
+        # Comparar el paquete con el árbol tal como está ahora, por si ha cambiado mientras se empaquetaba
+        current, current_numbers, extra = _walk_year(year_folder)
+        if current != packed or current_numbers != numbers or extra:
+            close_pack(year)
+            os.remove(path)
+            raise RuntimeError(f"{year_folder} ha cambiado durante el empaquetado; no se han borrado las carpetas")
+        shutil.rmtree(year_folder)
+    return count
+
+
+def unpack_year(year, remove_pack=True):
+    """Restaura data/<año> desde su paquete. Devuelve el número de PDFs extraídos."""
+    year = str(year)
+    path = pack_path(year)
+    year_folder = os.path.join(DATA_DIR, year)
+    close_pack(year)
+    with zipfile.ZipFile(path) as zf:
+        zf.extractall(year_folder)
+        count = sum(1 for info in zf.infolist() if not info.is_dir())
+    if remove_pack:
+        os.remove(path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archiva años cerrados en un único paquete indexado.")
+    parser.add_argument("action", choices=("pack", "unpack", "list"))
+    parser.add_argument("year")
+    parser.add_argument("--keep", action="store_true", help="No borrar las carpetas / el paquete de origen")
+    args = parser.parse_args(argv)
+
+    if args.action == "pack":
+        count = pack_year(args.year, remove_folders=not args.keep)
+        print(f"{count} PDFs empaquetados en {pack_path(args.year)}")
+    elif args.action == "unpack":
+        count = unpack_year(args.year, remove_pack=not args.keep)
+        print(f"{count} PDFs restaurados en {os.path.join(DATA_DIR, args.year)}")
+    else:
+        reader = open_pack(args.year)
+        for number in sorted(reader.numbers()):
+            print(number, len(reader.index[number]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
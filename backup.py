@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+
+from db import DB_NAME
+from manifest import file_hash
+from storage import DATA_DIR, BLOB_DB_NAME
+
+# Carpeta por defecto de las copias: una subcarpeta fechada por copia
+BACKUP_DIR = os.environ.get("INVOICE_BACKUP_DIR", "backups")
+MANIFEST_NAME = "backup_manifest.json"
+BACKUP_PAGES = 256  # páginas de SQLite por paso de la copia en caliente
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+def _copy_hashing(src, dst):
+    """Copia src en dst calculando el SHA-256 en la misma lectura. Conserva el mtime."""
+    digest = hashlib.sha256()
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for chunk in iter(lambda: fin.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, dst)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """Enlace duro a la copia anterior (sin duplicar datos); si no se puede, copia."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def backup_database(src_path, dst_path, pages=BACKUP_PAGES, journal_mode=None):
+    """
+    Copia consistente de una base SQLite con la API de copia en caliente, por pasos de `pages`
+    páginas para que la aplicación pueda seguir escribiendo entre paso y paso.
+    La copia hereda el modo de diario del origen (WAL) salvo que se indique otro en journal_mode.
+    """
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=pages, sleep=0.05)
+        if journal_mode:
+            dst.execute(f"PRAGMA journal_mode={journal_mode}")
+    finally:
+        dst.close()
+        src.close()
+
+
+def list_backups(target=BACKUP_DIR):
+    """Copias completas (con manifiesto) de la carpeta destino, de la más antigua a la más reciente."""
+    if not os.path.isdir(target):
+        return []
+    return [os.path.join(target, name) for name in sorted(os.listdir(target))
+            if os.path.isfile(os.path.join(target, name, MANIFEST_NAME))]
+
+
+def load_manifest(backup_path):
+    with open(os.path.join(backup_path, MANIFEST_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _data_files(data_dir):
+    """[(ruta relativa con '/', ruta)] de todos los archivos de data/ (PDFs y paquetes de años)."""
+    files = []
+    for root, _, names in os.walk(data_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, data_dir).replace(os.sep, "/"), path))
+    files.sort()
+    return files
+
+
+def run_backup(target=BACKUP_DIR, data_dir=DATA_DIR, db_path=DB_NAME, blob_db_path=BLOB_DB_NAME,
+               progress=None, cancel_event=None):
+    """
+    Crea <target>/<fecha_hora>/ con las bases de datos copiadas en caliente y data/ completo.
+    Los adjuntos sin cambios respecto a la copia anterior (mismo tamaño y mtime, o mismo hash)
+    se enlazan con enlaces duros; sólo se copian los nuevos o modificados.
+    La copia se escribe en una carpeta .part y se renombra al terminar.
+    Devuelve (ruta de la copia, archivos copiados, archivos enlazados).
+    """
+    previous = list_backups(target)
+    base = previous[-1] if previous else None
+    base_files = load_manifest(base)["files"] if base else {}
+
+    name = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    final_path = os.path.join(target, name)
+    suffix = 1
+    while os.path.exists(final_path) or os.path.exists(final_path + ".part"):
+        suffix += 1
+        final_path = os.path.join(target, f"{name}_{suffix}")
+    work_path = final_path + ".part"
+    os.makedirs(work_path)
+
+    databases = {}
+    for src in (db_path, blob_db_path):
+        if os.path.exists(src):
+            dst = os.path.join(work_path, os.path.basename(src))
+            # Sin WAL: la copia es un único archivo que no cambia al abrirla
+            backup_database(src, dst, journal_mode="DELETE")
+            databases[os.path.basename(src)] = file_hash(dst)
+
+    files = {}
+    copied = linked = 0
+    data_files = _data_files(data_dir) if os.path.isdir(data_dir) else []
+    for done, (rel, path) in enumerate(data_files, 1):
+        if cancel_event is not None and cancel_event.is_set():
+            shutil.rmtree(work_path, ignore_errors=True)
+            raise BackupCancelled()
+        st = os.stat(path)
+        dst = os.path.join(work_path, "data", *rel.split("/"))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        old = base_files.get(rel)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            digest = old["sha256"]
+        else:
+            digest = None
+        if digest is None and old and old["size"] == st.st_size:
+            # mtime distinto pero quizá el mismo contenido
+            digest = file_hash(path)
+        if old and digest == old["sha256"]:
+            _link_or_copy(os.path.join(base, "data", *rel.split("/")), dst)
+            linked += 1
+        else:
+            digest = _copy_hashing(path, dst)
+            copied += 1
+        files[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        if progress:
+            progress(done, len(data_files))
+
+    manifest = {"created": datetime.now().isoformat(timespec="seconds"),
+                "databases": databases, "files": files}
+    with open(os.path.join(work_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(work_path, final_path)
+    return final_path, copied, linked
+
+
+def verify_backup(backup_path, progress=None):
+    """
+    Comprueba tamaño y hash de cada archivo de la copia y la integridad de las bases de datos.
+    Devuelve la lista de problemas (vacía si la copia está bien).
+    """
+    manifest = load_manifest(backup_path)
+    problems = []
+    for name, digest in manifest["databases"].items():
+        path = os.path.join(backup_path, name)
+        if not os.path.exists(path) or file_hash(path) != digest:
+            problems.append(f"{name}: hash distinto")
+            continue
+        # immutable: no se crean -wal ni -shm en la copia (tampoco en las antiguas, que seguían en WAL)
+        conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        conn.close()
+        if result != "ok":
+            problems.append(f"{name}: {result}")
+    files = manifest["files"]
+    for done, (rel, info) in enumerate(sorted(files.items()), 1):
+        path = os.path.join(backup_path, "data", *rel.split("/"))
+        if not os.path.exists(path):
+            problems.append(f"data/{rel}: falta")
+        elif os.path.getsize(path) != info["size"] or file_hash(path) != info["sha256"]:
+            problems.append(f"data/{rel}: contenido distinto")
+        if progress:
+            progress(done, len(files))
+    return problems
+
+
+def restore_backup(backup_path, data_dir=DATA_DIR, db_path=DB_NAME, blob_db_path=BLOB_DB_NAME,
+                   prune=False, progress=None):
+    """
+    Restaura una copia: las bases de datos con la API de copia en caliente y en data/ sólo los
+    archivos que faltan o cuyo contenido es distinto. Con prune=True borra los archivos de data/
+    que no están en la copia. Devuelve (archivos restaurados, archivos borrados).
+    """
+    manifest = load_manifest(backup_path)
+    for name, dst in ((os.path.basename(db_path), db_path), (os.path.basename(blob_db_path), blob_db_path)):
+        if name in manifest["databases"]:
+            backup_database(os.path.join(backup_path, name), dst)
+
+    files = manifest["files"]
+    restored = 0
+    for done, (rel, info) in enumerate(sorted(files.items()), 1):
+        src = os.path.join(backup_path, "data", *rel.split("/"))
+        dst = os.path.join(data_dir, *rel.split("/"))
+        try:
+            st = os.stat(dst)
+            unchanged = st.st_size == info["size"] and (
+                st.st_mtime_ns == info["mtime_ns"] or file_hash(dst) == info["sha256"])
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst + ".part")
+            os.replace(dst + ".part", dst)
+            restored += 1
+        if progress:
+            progress(done, len(files))
+
+    removed = 0
+    if prune and os.path.isdir(data_dir):
+        for rel, path in _data_files(data_dir):
+            if rel not in files:
+                os.remove(path)
+                removed += 1
+    return restored, removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copias de seguridad incrementales de invoices.db y data/.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    create = sub.add_parser("create", help="Nueva copia fechada")
+    create.add_argument("--target", default=BACKUP_DIR)
+    sub.add_parser("list", help="Copias disponibles").add_argument("--target", default=BACKUP_DIR)
+    verify = sub.add_parser("verify", help="Comprobar una copia")
+    verify.add_argument("backup", nargs="?", help="Carpeta de la copia (por defecto la más reciente)")
+    verify.add_argument("--target", default=BACKUP_DIR)
+    restore = sub.add_parser("restore", help="Restaurar una copia (con la aplicación cerrada)")
+    restore.add_argument("backup", nargs="?", help="Carpeta de la copia (por defecto la más reciente)")
+    restore.add_argument("--target", default=BACKUP_DIR)
+    restore.add_argument("--prune", action="store_true", help="Borrar de data/ los archivos que no están en la copia")
+    args = parser.parse_args(argv)
+
+    if args.action == "create":
+        start = time.perf_counter()
+        path, copied, linked = run_backup(args.target)
+        print(f"{path}: {copied} archivos copiados, {linked} sin cambios ({time.perf_counter() - start:.1f}s)")
+        return 0
+    if args.action == "list":
+        for path in list_backups(args.target):
+            manifest = load_manifest(path)
+            print(f"{path}  {len(manifest['files'])} archivos")
+        return 0
+
+    backups = list_backups(args.target)
+    backup_path = args.backup or (backups[-1] if backups else None)
+    if backup_path is None:
+        print(f"No hay copias en {args.target}")
+        return 1
+    if args.action == "verify":
+        problems = verify_backup(backup_path)
+        for problem in problems:
+            print(problem)
+        print(f"{backup_path}: {'correcta' if not problems else f'{len(problems)} problemas'}")
+        return 1 if problems else 0
+    restored, removed = restore_backup(backup_path, prune=args.prune)
+    print(f"{backup_path} restaurada: {restored} archivos restaurados, {removed} borrados")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Compara los backends de almacenamiento (carpetas vs blobs SQLite) en ingesta y lectura.
+
+    python bench_storage.py --files 200 --size-kb 512
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+import storage
+
+
+def _make_sources(directory, count, size):
+    """Genera PDFs sintéticos (contenido aleatorio con cabecera PDF) para la prueba."""
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"src_{i:05d}.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n" + os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def _run(backend, sources, invoices):
+    """Ingresa todos los PDFs y los vuelve a leer por bloques; devuelve (s_ingesta, s_lectura)."""
+    store = storage.create_storage(backend)
+    folders = [os.path.join(storage.DATA_DIR, "2099", str(n)) for n in range(invoices)]
+
+    start = time.perf_counter()
+    for i, src in enumerate(sources):
+        folder = folders[i % invoices]
+        store.put(folder, os.path.basename(src), src)
+    ingest = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0
+    for folder in folders:
+        for filename, _, _ in store.list(folder):
+            for chunk in store.stream(folder, filename):
+                total += len(chunk)
+    read = time.perf_counter() - start
+    return ingest, read, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--invoices", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        os.makedirs("sources")
+        sources = _make_sources("sources", args.files, args.size_kb * 1024)
+        megabytes = args.files * args.size_kb / 1024
+        print(f"{args.files} PDFs x {args.size_kb} KB ({megabytes:.1f} MB) en {args.invoices} facturas")
+        print(f"{'backend':<8} {'ingesta MB/s':>14} {'lectura MB/s':>14}")
+        for backend in ("folder", "sqlite"):
+            ingest, read, total = _run(backend, sources, args.invoices)
+            assert total == sum(os.path.getsize(s) for s in sources)
+            print(f"{backend:<8} {megabytes / ingest:>14.1f} {megabytes / read:>14.1f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
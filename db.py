@@ -1,12 +1,82 @@
 import sqlite3
 import os
+import re
+import heapq
+import itertools
+from datetime import datetime
 
 DB_NAME = "invoices.db"
 
+# Año de la carpeta data/<año>/<número>, guardado en su propia columna indexada al escribir
+# (sirve igual para rutas con \\, absolutas o con otro prefijo)
+_YEAR_WHERE = "year = ?"
+
+# Dígitos a los que se rellenan los tramos numéricos de la clave de orden natural
+NATURAL_KEY_DIGITS = 12
+
+# Columnas por las que se pueden ordenar las vistas, cada una con su índice
+SORT_COLUMNS = {"number": "number_key", "name": "name COLLATE NOCASE", "date": "date"}
+
+# COLLATE NOCASE de SQLite sólo pliega las mayúsculas ASCII; la clave de Python debe hacer lo mismo
+_NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# Carpetas por consulta al pedir el resumen de adjuntos de una lista de carpetas
+SUMMARY_BATCH_SIZE = 500
+
+# Formatos de fecha heredados que se convierten a ISO (AAAA-MM-DD)
+LEGACY_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y")
+
+
+def normalize_date(value):
+    """
+    Convierte una fecha a ISO AAAA-MM-DD (ordenable). Devuelve el valor original si no se reconoce;
+    sólo el año (antiguo valor por defecto del cargador por año) se conserva tal cual, porque el día
+    no se conoce y no se debe inventar.
+    """
+    text = (value or "").strip()
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return value
+
+
+def folder_year(folder):
+    """Año de una carpeta .../data/<año>/<número> (con / o \\, relativa o absoluta), o None."""
+    parts = re.split(r"[\\/]+", (folder or "").rstrip("\\/"))
+    if len(parts) >= 3 and parts[-3] == "data" and len(parts[-2]) == 4 and parts[-2].isdigit():
+        return parts[-2]
+    return None
+
+
+def natural_key(number):
+    """Clave de orden natural de un número de factura: "25-A" -> "000000000025-a", "3" < "25" < "25-A"."""
+    return re.sub(r"\d+", lambda m: m.group().zfill(NATURAL_KEY_DIGITS), (number or "").strip().lower())
+
+
+def row_sort_key(row, sort="number"):
+    """La misma clave que ORDER BY aplicada a una fila de get_invoices() (para mezclar filas ya ordenadas)."""
+    if sort == "number":
+        return natural_key(row[1])
+    if sort == "name":
+        return (row[5] if len(row) >= 6 and row[5] else "").translate(_NOCASE)
+    return row[2] or ""
+
+
+def order_by(sort="number", descending=True, alias=""):
+    """Cláusula ORDER BY indexada para una columna de SORT_COLUMNS (empates por id)."""
+    direction = "DESC" if descending else "ASC"
+    return f" ORDER BY {alias}{SORT_COLUMNS[sort]} {direction}, {alias}id {direction}"
+
+
 def init_db():
     """Crea la base de datos y la tabla si no existen."""
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
+
+    # WAL: los lectores (API local, exportaciones) no bloquean a la aplicación al escribir
+    cur.execute("PRAGMA journal_mode=WAL")
     
     # Crear tabla principal si no existe
     cur.execute("""
@@ -27,28 +97,144 @@ def init_db():
         print("Añadiendo columna 'name' a la base de datos...")
         cur.execute("ALTER TABLE invoices ADD COLUMN name TEXT DEFAULT ''")
         print("Columna 'name' añadida exitosamente.")
+
+    # Manifiesto de adjuntos por carpeta de factura (evita listar el disco en cada selección)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attachment_folders (
+            folder TEXT PRIMARY KEY,
+            mtime_ns INTEGER
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attachments (
+            folder TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            pages INTEGER,
+            hash TEXT,
+            PRIMARY KEY (folder, filename)
+        )
+    """)
+    # Metadatos del PDF extraídos una sola vez por versión del archivo (tamaño + mtime)
+    for column, definition in (("created", "TEXT"), ("title", "TEXT"),
+                               ("encrypted", "INTEGER"), ("damaged", "INTEGER"),
+                               ("extracted", "INTEGER NOT NULL DEFAULT 0")):
+        _add_column_if_missing(cur, "attachments", column, definition)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_attachments_pending ON attachments(extracted)")
+
+    # Resultado de la optimización de cada PDF al ingresarlo (tamaños antes/después)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_optimizations (
+            folder TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size_before INTEGER NOT NULL,
+            size_after INTEGER NOT NULL,
+            replaced INTEGER NOT NULL,
+            optimized_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (folder, filename)
+        )
+    """)
+
+    # Contador de cambios de la tabla invoices, mantenido por triggers: la búsqueda sólo descarta su
+    # catálogo cuando cambian las facturas, no con cada escritura del manifiesto o de los metadatos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS invoices_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO invoices_version (id, version) VALUES (0, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS invoices_version_{event.lower()} AFTER {event} ON invoices
+            BEGIN UPDATE invoices_version SET version = version + 1 WHERE id = 0; END
+        """)
+
+    _migrate(cur)
     
     conn.commit()
     conn.close()
 
 
+def _migrate(cur):
+    """Aplica las migraciones de datos pendientes según PRAGMA user_version."""
+    cur.execute("PRAGMA user_version")
+    version = cur.fetchone()[0]
+
+    if version < 1:
+        # Fechas normalizadas a ISO e índices para los filtros
+        cur.execute("SELECT id, date FROM invoices")
+        updates = []
+        for invoice_id, date in cur.fetchall():
+            normalized = normalize_date(date)
+            if normalized != date:
+                updates.append((normalized, invoice_id))
+        cur.executemany("UPDATE invoices SET date=? WHERE id=?", updates)
+        if updates:
+            print(f"{len(updates)} fechas normalizadas a AAAA-MM-DD.")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status_date ON invoices(status, date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_name ON invoices(name COLLATE NOCASE)")
+        cur.execute("PRAGMA user_version = 1")
+
+    if version < 2:
+        # Año de la carpeta data/<año>/<número> en su propia columna indexada (rellenada al escribir,
+        # valga la ruta con / o \, relativa o absoluta), para cargar la vista de todos los años por partes
+        # Los índices (year, orden) sirven a la vez el filtro por año y el ORDER BY, sin B-tree temporal
+        _add_column_if_missing(cur, "invoices", "year", "TEXT")
+        _add_column_if_missing(cur, "attachment_folders", "year", "TEXT")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_year_date ON invoices(year, date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_year_name ON invoices(year, name COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_attachment_folders_year ON attachment_folders(year)")
+        cur.execute("PRAGMA user_version = 2")
+
+    if version < 3:
+        # Búsquedas por número (estado, borrado, números duplicados en la reconciliación)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(number)")
+        cur.execute("PRAGMA user_version = 3")
+
+    if version < 4:
+        # Clave de orden natural precalculada e indexada: las vistas ya llegan ordenadas por número
+        _add_column_if_missing(cur, "invoices", "number_key", "TEXT")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_number_key ON invoices(number_key)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_year_number_key ON invoices(year, number_key)")
+        cur.execute("PRAGMA user_version = 4")
+
+    # Filas insertadas sin clave o sin año (por ejemplo por otras herramientas)
+    cur.execute("SELECT id, number FROM invoices WHERE number_key IS NULL")
+    cur.executemany("UPDATE invoices SET number_key=? WHERE id=?",
+                    [(natural_key(number), invoice_id) for invoice_id, number in cur.fetchall()])
+    for table, key in (("invoices", "id"), ("attachment_folders", "folder")):
+        cur.execute(f"SELECT {key}, folder FROM {table} WHERE year IS NULL")
+        updates = [(folder_year(folder), row_key) for row_key, folder in cur.fetchall()]
+        cur.executemany(f"UPDATE {table} SET year=? WHERE {key}=?", [u for u in updates if u[0]])
+
+
+def _add_column_if_missing(cur, table, column, definition):
+    """Añade una columna a una tabla existente si todavía no la tiene."""
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
 def add_invoice(number, name, date, folder, status="incompleto"):
     """Añade una factura a la base de datos."""
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
     cur.execute("""
-        INSERT INTO invoices (number, name, date, folder, status)
-        VALUES (?, ?, ?, ?, ?)
-    """, (number, name, date, folder, status))
+        INSERT INTO invoices (number, name, date, folder, status, number_key, year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (number, name, normalize_date(date), folder, status, natural_key(number), folder_year(folder)))
     conn.commit()
     conn.close()
 
 
-def get_invoices():
-    """Obtiene todas las facturas de la base de datos."""
+def get_invoices(sort="date", descending=True):
+    """Obtiene todas las facturas de la base de datos, ordenadas por number, name o date."""
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
-    cur.execute("SELECT * FROM invoices ORDER BY date DESC")
+    cur.execute("SELECT * FROM invoices" + order_by(sort, descending))
     rows = cur.fetchall()
     conn.close()
     return rows
@@ -77,3 +263,362 @@ def delete_invoice(number):
     c.execute("DELETE FROM invoices WHERE number = ?", (number,))
     conn.commit()
     conn.close()
+
+
+# ===== MANIFIESTO DE ADJUNTOS =====
+
+ATTACHMENT_FIELDS = ("filename", "size", "mtime_ns", "pages", "hash",
+                     "created", "title", "encrypted", "damaged", "extracted")
+METADATA_FIELDS = ("pages", "hash", "created", "title", "encrypted", "damaged")
+
+
+def get_folder_manifest(folder):
+    """Devuelve (mtime_ns, adjuntos) guardados para una carpeta, o (None, None) si no hay manifiesto."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT mtime_ns FROM attachment_folders WHERE folder=?", (folder,))
+    row = cur.fetchone()
+    if row is None:
+        conn.close()
+        return None, None
+    cur.execute(f"""
+        SELECT {", ".join(ATTACHMENT_FIELDS)} FROM attachments
+        WHERE folder=? ORDER BY filename COLLATE NOCASE
+    """, (folder,))
+    entries = [dict(zip(ATTACHMENT_FIELDS, r)) for r in cur.fetchall()]
+    conn.close()
+    return row[0], entries
+
+
+def save_folder_manifest(folder, mtime_ns, entries):
+    """Sustituye el manifiesto de una carpeta en una sola transacción."""
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.execute("DELETE FROM attachments WHERE folder=?", (folder,))
+        conn.executemany(f"""
+            INSERT INTO attachments (folder, {", ".join(ATTACHMENT_FIELDS)})
+            VALUES (?{", ?" * len(ATTACHMENT_FIELDS)})
+        """, [(folder,) + tuple(e[f] for f in ATTACHMENT_FIELDS) for e in entries])
+        conn.execute("""
+            INSERT OR REPLACE INTO attachment_folders (folder, mtime_ns, year) VALUES (?, ?, ?)
+        """, (folder, mtime_ns, folder_year(folder)))
+    conn.close()
+
+
+def invalidate_folder_manifest(folder):
+    """Marca el manifiesto de una carpeta como obsoleto para forzar un nuevo escaneo."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("UPDATE attachment_folders SET mtime_ns=NULL WHERE folder=?", (folder,))
+    conn.commit()
+    conn.close()
+
+
+def delete_folder_manifest(folder):
+    """Elimina el manifiesto de una carpeta (por ejemplo al borrar la factura)."""
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.execute("DELETE FROM attachments WHERE folder=?", (folder,))
+        conn.execute("DELETE FROM attachment_folders WHERE folder=?", (folder,))
+    conn.close()
+
+
+def get_attachment_summary(folder=None, year=None, folders=None):
+    """
+    Devuelve {carpeta: (número de PDFs, páginas, bytes)} según el manifiesto, sin tocar el disco.
+    Se puede limitar a una carpeta, a las carpetas de un año o a una lista de carpetas
+    (claves del manifiesto; se consultan por lotes con la clave primaria).
+    """
+    if folders is not None:
+        folders = list(dict.fromkeys(folders))
+        queries = [(f"WHERE f.folder IN ({', '.join('?' * len(batch))})", batch)
+                   for batch in (folders[i:i + SUMMARY_BATCH_SIZE]
+                                 for i in range(0, len(folders), SUMMARY_BATCH_SIZE))]
+    elif folder is not None:
+        queries = [("WHERE f.folder = ?", (folder,))]
+    elif year is not None:
+        queries = [("WHERE f.year = ?", (year,))]
+    else:
+        queries = [("", ())]
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    summary = {}
+    for where, params in queries:
+        cur.execute(f"""
+            SELECT f.folder, COUNT(a.filename), SUM(a.pages), SUM(a.size) FROM attachment_folders f
+            LEFT JOIN attachments a ON a.folder = f.folder
+            {where}
+            GROUP BY f.folder
+        """, params)
+        summary.update({folder: (count, pages, size) for folder, count, pages, size in cur.fetchall()})
+    conn.close()
+    return summary
+
+
+def get_pending_metadata(limit=50, folder=None):
+    """Devuelve [(carpeta, archivo, tamaño, mtime_ns)] de adjuntos sin metadatos extraídos."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    if folder is None:
+        cur.execute("""
+            SELECT folder, filename, size, mtime_ns FROM attachments WHERE extracted=0 LIMIT ?
+        """, (limit,))
+    else:
+        cur.execute("""
+            SELECT folder, filename, size, mtime_ns FROM attachments
+            WHERE extracted=0 AND folder=? LIMIT ?
+        """, (folder, limit))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def save_attachment_metadata(results):
+    """
+    Guarda en un solo lote los metadatos extraídos: results es [(carpeta, archivo, tamaño, mtime_ns, metadatos)].
+    Sólo se actualizan las filas cuyo tamaño y mtime no han cambiado desde la extracción.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.executemany(f"""
+            UPDATE attachments SET {", ".join(f"{f}=?" for f in METADATA_FIELDS)}, extracted=1
+            WHERE folder=? AND filename=? AND size=? AND mtime_ns=?
+        """, [tuple(meta.get(f) for f in METADATA_FIELDS) + (folder, filename, size, mtime_ns)
+              for folder, filename, size, mtime_ns, meta in results])
+    conn.close()
+
+
+def record_pdf_optimization(folder, filename, size_before, size_after, replaced):
+    """Guarda el resultado de optimizar un PDF."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT OR REPLACE INTO pdf_optimizations (folder, filename, size_before, size_after, replaced)
+        VALUES (?, ?, ?, ?, ?)
+    """, (folder, filename, size_before, size_after, int(replaced)))
+    conn.commit()
+    conn.close()
+
+
+# ===== CONSULTAS PARA EXPORTACIÓN =====
+
+def _invoice_filters(year=None, status=None, date_from=None, date_to=None, query=None, name=None):
+    """Construye la cláusula WHERE y sus parámetros para los filtros de facturas."""
+    clauses, params = [], []
+    if name:
+        # Prefijo con LIKE (sin distinguir mayúsculas) para poder usar idx_invoices_name
+        escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("i.name LIKE ? ESCAPE '\\'")
+        params.append(escaped + "%")
+    if query:
+        clauses.append("(i.number LIKE ? OR i.name LIKE ? OR i.date LIKE ?)")
+        params += [f"%{query}%"] * 3
+    if year:
+        # El año de una factura es el de su carpeta data/<año>/<número> (usa los índices idx_invoices_year_*)
+        clauses.append("i.year = ?")
+        params.append(year)
+    if status:
+        clauses.append("i.status = ?")
+        params.append(status)
+    if date_from:
+        clauses.append("i.date >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("i.date <= ?")
+        params.append(date_to)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def count_invoices(year=None, status=None, date_from=None, date_to=None, query=None):
+    """Cuenta las facturas que cumplen los filtros."""
+    where, params = _invoice_filters(year, status, date_from, date_to, query)
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM invoices i{where}", params)
+    total = cur.fetchone()[0]
+    conn.close()
+    return total
+
+
+def iter_invoices(year=None, status=None, date_from=None, date_to=None,
+                  with_attachments=False, batch_size=500):
+    """
+    Recorre las facturas filtradas en lotes de batch_size con fetchmany, sin cargarlas todas en memoria.
+    Produce tuplas (id, number, name, date, status, folder) y, con with_attachments,
+    además (filename, size, pages) de cada adjunto del manifiesto (una fila por adjunto).
+    """
+    where, params = _invoice_filters(year, status, date_from, date_to)
+    columns = "i.id, i.number, i.name, i.date, i.status, i.folder"
+    if with_attachments:
+        query = f"""
+            SELECT {columns}, a.filename, a.size, a.pages FROM invoices i
+            LEFT JOIN attachments a ON a.folder = i.folder{where}
+            ORDER BY i.date DESC, i.id, a.filename COLLATE NOCASE
+        """
+    else:
+        query = f"SELECT {columns} FROM invoices i{where} ORDER BY i.date DESC, i.id"
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def list_invoices(limit=50, offset=0, year=None, status=None, date_from=None, date_to=None, query=None):
+    """Devuelve una página de facturas (id, number, name, date, status, folder) que cumplen los filtros."""
+    where, params = _invoice_filters(year, status, date_from, date_to, query)
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT i.id, i.number, i.name, i.date, i.status, i.folder FROM invoices i{where}
+        ORDER BY i.date DESC, i.id LIMIT ? OFFSET ?
+    """, params + [limit, offset])
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def get_invoice(number):
+    """Devuelve la factura (id, number, name, date, status, folder) con ese número, o None."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT id, number, name, date, status, folder FROM invoices WHERE number=?", (number,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def filter_invoices(status=None, date_from=None, date_to=None, name=None, year=None,
+                    sort="date", descending=True):
+    """
+    Filtra las facturas por estado, rango de fechas (AAAA-MM-DD, inclusivo), prefijo del nombre
+    y año con una consulta indexada. Devuelve filas como get_invoices(), en el orden pedido.
+    """
+    where, params = _invoice_filters(year=year, status=status, date_from=date_from, date_to=date_to, name=name)
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute(f"SELECT i.* FROM invoices i{where}" + order_by(sort, descending, "i."), params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# ===== VISTA DE TODOS LOS AÑOS =====
+
+def get_year_counts():
+    """
+    Devuelve [(año, número de facturas)] de más reciente a más antiguo, contando las facturas de la BD
+    y las carpetas ya vistas en el manifiesto (sin recorrer el disco).
+    """
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT year, COUNT(*) FROM (
+            SELECT folder, year FROM invoices WHERE year IS NOT NULL
+            UNION
+            SELECT folder, year FROM attachment_folders WHERE mtime_ns IS NOT NULL AND year IS NOT NULL
+        )
+        GROUP BY year ORDER BY year DESC
+    """)
+    counts = cur.fetchall()
+    conn.close()
+    return counts
+
+
+def get_year_invoices(year, sort="number", descending=True, limit=None):
+    """
+    Devuelve las facturas de un año como filas de get_invoices() (id, number, date, folder, status, name),
+    en el orden pedido y como mucho limit filas. Las carpetas que sólo están en el manifiesto se intercalan
+    sin id, sin fecha y como incompletas, igual que en la vista por año y que reconcile.py al darlas de alta.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = f"SELECT id, number, date, folder, status, name FROM invoices WHERE {_YEAR_WHERE}" + order_by(sort, descending)
+    params = (year,)
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    cur.execute(query, params)
+    fetched = cur.fetchall()
+    rows, seen = [], set()
+    for row in fetched:
+        key = os.path.normpath(row[3])
+        if key not in seen:
+            seen.add(key)
+            rows.append(row)
+    if limit is not None and len(fetched) == limit:
+        # Con el límite alcanzado quedan filas de la BD sin leer: sus carpetas tampoco son extra
+        cur.execute(f"SELECT folder FROM invoices WHERE {_YEAR_WHERE}", (year,))
+        seen.update(os.path.normpath(folder) for (folder,) in cur.fetchall())
+    cur.execute(f"SELECT folder FROM attachment_folders WHERE mtime_ns IS NOT NULL AND {_YEAR_WHERE}", (year,))
+    folders = [folder for (folder,) in cur.fetchall()]
+    conn.close()
+    extra = []
+    for folder in folders:
+        key = os.path.normpath(folder)
+        if key not in seen:
+            seen.add(key)
+            extra.append((None, os.path.basename(key), "", folder, "incompleto", ""))
+    if not extra:
+        return rows
+    key = lambda row: row_sort_key(row, sort)
+    extra.sort(key=key, reverse=descending)
+    merged = heapq.merge(rows, extra, key=key, reverse=descending)
+    return list(itertools.islice(merged, limit))
+
+
+# ===== RECONCILIACIÓN CON EL DISCO =====
+
+def get_invoice_locations():
+    """Devuelve [(id, número, carpeta)] de todas las facturas, ordenadas por número."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT id, number, folder FROM invoices ORDER BY number, id")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def get_folder_mtimes():
+    """Devuelve {carpeta: mtime_ns} del manifiesto (mtime de la última vez que se listó cada carpeta)."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT folder, mtime_ns FROM attachment_folders")
+    mtimes = dict(cur.fetchall())
+    conn.close()
+    return mtimes
+
+
+def get_damaged_attachments():
+    """Devuelve [(carpeta, archivo)] de los adjuntos marcados como dañados al extraer sus metadatos."""
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT folder, filename FROM attachments WHERE damaged=1 ORDER BY folder, filename")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def apply_reconciliation(add=(), delete_ids=(), drop_manifests=()):
+    """
+    Aplica las correcciones de la reconciliación en una sola transacción:
+    add = [(número, fecha, carpeta, estado)] a insertar, delete_ids = ids de facturas a borrar,
+    drop_manifests = carpetas cuyo manifiesto ya no sirve.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.executemany("""
+            INSERT INTO invoices (number, name, date, folder, status, number_key, year) VALUES (?, '', ?, ?, ?, ?, ?)
+        """, [(number, normalize_date(date), folder, status, natural_key(number), folder_year(folder))
+              for number, date, folder, status in add])
+        conn.executemany("DELETE FROM invoices WHERE id=?", [(i,) for i in delete_ids])
+        conn.executemany("DELETE FROM attachments WHERE folder=?", [(f,) for f in drop_manifests])
+        conn.executemany("DELETE FROM attachment_folders WHERE folder=?", [(f,) for f in drop_manifests])
+    conn.close()
@@ -0,0 +1,220 @@
+import os
+import re
+import csv
+import json
+import zipfile
+import argparse
+from xml.sax.saxutils import escape
+
+from db import init_db, count_invoices, iter_invoices
+
+FORMATS = ("csv", "jsonl", "xlsx")
+INVOICE_COLUMNS = ("number", "name", "date", "status", "folder")
+ATTACHMENT_COLUMNS = ("filename", "size", "pages")
+
+# Caracteres de control que no admite XML 1.0
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class ExportCancelled(Exception):
+    """Se lanza cuando el usuario cancela una exportación en curso."""
+
+
+def format_from_path(path):
+    """Deduce el formato de exportación a partir de la extensión del archivo."""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext == "json":
+        ext = "jsonl"
+    if ext not in FORMATS:
+        raise ValueError(f"Formato no soportado: '{ext}' (usa {', '.join(FORMATS)})")
+    return ext
+
+
+def group_invoices(rows, with_attachments):
+    """
+    Agrupa las filas planas de iter_invoices en (factura, adjuntos).
+    Las filas llegan ordenadas por factura, así que basta con mirar la anterior.
+    """
+    current_id, invoice, attachments = None, None, []
+    for row in rows:
+        if row[0] != current_id:
+            if invoice is not None:
+                yield invoice, attachments
+            current_id = row[0]
+            invoice = dict(zip(INVOICE_COLUMNS, row[1:6]))
+            attachments = []
+        if with_attachments and row[6] is not None:
+            attachments.append(dict(zip(ATTACHMENT_COLUMNS, row[6:9])))
+    if invoice is not None:
+        yield invoice, attachments
+
+
+def _write_csv(f, invoices, with_attachments):
+    writer = csv.writer(f)
+    writer.writerow(INVOICE_COLUMNS + (ATTACHMENT_COLUMNS if with_attachments else ()))
+    for invoice, attachments in invoices:
+        base = [invoice[c] for c in INVOICE_COLUMNS]
+        if not with_attachments:
+            writer.writerow(base)
+        elif not attachments:
+            writer.writerow(base + [""] * len(ATTACHMENT_COLUMNS))
+        else:
+            for attachment in attachments:
+                writer.writerow(base + [attachment[c] for c in ATTACHMENT_COLUMNS])
+        yield
+
+
+def _write_jsonl(f, invoices, with_attachments):
+    for invoice, attachments in invoices:
+        record = dict(invoice)
+        if with_attachments:
+            record["attachments"] = attachments
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        yield
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = _INVALID_XML_CHARS.sub("", "" if value is None else str(value))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return "<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>"
+
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Invoices" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _write_xlsx(path, invoices, with_attachments):
+    """Escribe un .xlsx mínimo; la hoja se va volcando al zip fila a fila."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            zf.writestr(name, content)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as raw:
+            def write(text):
+                raw.write(text.encode("utf-8"))
+
+            write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            write(_xlsx_row(INVOICE_COLUMNS + (ATTACHMENT_COLUMNS if with_attachments else ())))
+            for invoice, attachments in invoices:
+                base = [invoice[c] for c in INVOICE_COLUMNS]
+                if not attachments:
+                    write(_xlsx_row(base))
+                else:
+                    for attachment in attachments:
+                        write(_xlsx_row(base + [attachment[c] for c in ATTACHMENT_COLUMNS]))
+                yield
+            write("</sheetData></worksheet>")
+
+
+def export_invoices(path, fmt=None, year=None, status=None, date_from=None, date_to=None,
+                    with_attachments=False, progress=None, cancel_event=None, batch_size=500):
+    """
+    Exporta el catálogo de facturas a CSV, JSON Lines o Excel (.xlsx) en streaming:
+    las filas se leen de SQLite por lotes y se escriben según llegan, con memoria constante.
+    Los filtros se aplican en la consulta SQL. Se escribe en un archivo temporal que sólo
+    sustituye al destino cuando la exportación termina. Devuelve el número de facturas exportadas.
+    """
+    fmt = fmt or format_from_path(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: '{fmt}'")
+
+    total = count_invoices(year, status, date_from, date_to)
+    rows = iter_invoices(year, status, date_from, date_to, with_attachments, batch_size)
+    invoices = group_invoices(rows, with_attachments)
+    tmp_path = path + ".part"
+
+    done = 0
+    try:
+        if fmt == "xlsx":
+            steps = _write_xlsx(tmp_path, invoices, with_attachments)
+            done = _drain(steps, total, progress, cancel_event, batch_size)
+        else:
+            # utf-8-sig para que Excel detecte la codificación del CSV
+            encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+            with open(tmp_path, "w", encoding=encoding, newline="") as f:
+                writer = _write_csv if fmt == "csv" else _write_jsonl
+                done = _drain(writer(f, invoices, with_attachments), total, progress, cancel_event, batch_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        rows.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return done
+
+
+def _drain(steps, total, progress, cancel_event, every):
+    """Consume el escritor factura a factura, notificando progreso y atendiendo la cancelación."""
+    done = 0
+    for _ in steps:
+        done += 1
+        if done % every == 0:
+            if cancel_event is not None and cancel_event.is_set():
+                steps.close()
+                raise ExportCancelled()
+            if progress:
+                progress(done, total)
+    if progress:
+        progress(done, total)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta el catálogo de facturas.")
+    parser.add_argument("output", help="Archivo de salida (.csv, .jsonl o .xlsx)")
+    parser.add_argument("--format", choices=FORMATS, help="Formato (por defecto según la extensión)")
+    parser.add_argument("--year", help="Año de la carpeta de facturas (p. ej. 2025)")
+    parser.add_argument("--status", choices=("completo", "incompleto"))
+    parser.add_argument("--from", dest="date_from", help="Fecha inicial YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="Fecha final YYYY-MM-DD")
+    parser.add_argument("--attachments", action="store_true", help="Incluir los PDFs de cada factura")
+    args = parser.parse_args(argv)
+
+    init_db()
+    count = export_invoices(args.output, args.format, args.year, args.status,
+                            args.date_from, args.date_to, args.attachments,
+                            progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    print(f"\n{count} facturas exportadas a {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,38 @@
 import sys
 import os
-import shutil
 import subprocess
+import threading
+import multiprocessing
+import difflib
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
 from PyQt6 import QtWidgets, QtCore, QtGui
 from PyQt6 import QtWebEngineWidgets
 from PyQt6.QtCore import QUrl, QUrlQuery
 from PyQt6.QtGui import QIcon
-from db import init_db, add_invoice, get_invoices, update_invoice_status, update_invoice_name
+from db import (init_db, add_invoice, get_invoices, update_invoice_status, update_invoice_name,
+                invalidate_folder_manifest, delete_folder_manifest, get_attachment_summary,
+                filter_invoices, get_year_counts, get_year_invoices, SORT_COLUMNS)
+import manifest
+import archive
+from storage import get_storage
+from search import InvoiceSearch
+import pdfopt
+import pdfpool
+import printpack
+import reconcile
+import snapshot
+import backup
+from prefetch import Prefetcher
+from export import export_invoices, FORMATS
+
+# Entrada del selector de año que muestra todos los años en una sola lista
+ALL_YEARS = "All years"
+# Años de la vista completa que se mantienen rellenos en la tabla a la vez
+MAX_LOADED_YEARS = 3
+# Columnas de la tabla que se pueden ordenar (ordenación en SQL) y su sentido inicial (descendente o no)
+SORTABLE_COLUMNS = {0: ("number", True), 1: ("name", False), 2: ("date", True)}
 
 # Función para obtener la ruta correcta de recursos (para PyInstaller)
 def resource_path(relative_path):
@@ -128,6 +154,52 @@ futuristic_style_dialog = """
 """
 
 
+def format_size(size):
+    """Formatea un tamaño en bytes como KB o MB"""
+    if size is None:
+        return ""
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{max(size // 1024, 1)} KB"
+
+
+@lru_cache(maxsize=4096)
+def format_date(date_str):
+    """Convierte una fecha AAAA-MM-DD a DD/MM/AAAA. Se calcula una sola vez por valor distinto."""
+    if date_str and len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-":
+        return f"{date_str[8:10]}/{date_str[5:7]}/{date_str[0:4]}"
+    # Sólo el año u otros formatos: se muestran tal cual
+    return date_str
+
+
+class WorkerSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int, int)
+
+
+class Worker(QtCore.QRunnable):
+    """Ejecuta una función en el pool de hilos de Qt y entrega el resultado por señales"""
+
+    def __init__(self, fn, *args, report_progress=False, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        # La función recibe progress(hecho, total) para informar del avance
+        if report_progress:
+            self.kwargs["progress"] = self.signals.progress.emit
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
 class DropArea(QtWidgets.QWidget):
     filesDropped = QtCore.pyqtSignal(list)
 
@@ -160,6 +232,7 @@ class DropArea(QtWidgets.QWidget):
 
 class InvoiceCreateDialog(QtWidgets.QDialog):
     invoiceCreated = QtCore.pyqtSignal()
+    filesStored = QtCore.pyqtSignal(str, list)  # carpeta, PDFs copiados
 
     def __init__(self, current_year="2025"):
         super().__init__()
@@ -243,33 +316,94 @@ class InvoiceCreateDialog(QtWidgets.QDialog):
         # Usar el año seleccionado en el desplegable para crear la carpeta
         year = self.current_year
         year_folder = os.path.join("data", year)
+        storage = get_storage()
         
-        # Crear carpeta del año si no existe
-        if not os.path.exists(year_folder):
-            os.makedirs(year_folder)
-        
-        # Crear carpeta de la factura dentro del año
+        # Crear carpeta de la factura dentro del año (y la del año si no existe)
         invoice_folder = os.path.join(year_folder, number)
-        if not os.path.exists(invoice_folder):
-            os.makedirs(invoice_folder)
+        storage.create_folder(invoice_folder)
 
         add_invoice(number, name, date, invoice_folder, "incompleto")
 
+        stored = []
         for file_path in self.files_to_copy:
             filename = os.path.basename(file_path)
-            dest_path = os.path.join(invoice_folder, filename)
-            if not os.path.exists(dest_path):
+            if not storage.exists(invoice_folder, filename):
                 try:
-                    shutil.copy(file_path, dest_path)
+                    storage.put(invoice_folder, filename, file_path)
+                    stored.append(filename)
                 except Exception as e:
                     QtWidgets.QMessageBox.warning(self, "Error Copying File", f"Could not copy {filename}:\n{str(e)}")
+        if stored:
+            self.filesStored.emit(invoice_folder, stored)
 
         QtWidgets.QMessageBox.information(self, "Invoice Saved", f"Invoice '{number}' saved in {year} with {len(self.files_to_copy)} PDFs.")
         self.invoiceCreated.emit()
         self.close()
 
 
+class ExportDialog(QtWidgets.QDialog):
+    """Diálogo con los filtros y el formato de la exportación del catálogo"""
+
+    def __init__(self, years, current_year=None):
+        super().__init__()
+        self.setWindowTitle("Export Invoices")
+        self.setMinimumWidth(350)
+        self.setStyleSheet(futuristic_style_dialog)
+
+        layout = QtWidgets.QFormLayout(self)
+
+        self.format_combo = QtWidgets.QComboBox()
+        self.format_combo.addItems(FORMATS)
+        layout.addRow("Format:", self.format_combo)
+
+        self.year_combo = QtWidgets.QComboBox()
+        self.year_combo.addItems(["All"] + list(years))
+        if current_year in years:
+            self.year_combo.setCurrentText(current_year)
+        layout.addRow("Year:", self.year_combo)
+
+        self.status_combo = QtWidgets.QComboBox()
+        self.status_combo.addItems(["All", "completo", "incompleto"])
+        layout.addRow("Status:", self.status_combo)
+
+        # Rango de fechas opcional
+        self.date_range_check = QtWidgets.QCheckBox("Filter by date")
+        layout.addRow(self.date_range_check)
+        self.date_from = QtWidgets.QDateEdit(QtCore.QDate(QtCore.QDate.currentDate().year(), 1, 1))
+        self.date_to = QtWidgets.QDateEdit(QtCore.QDate.currentDate())
+        for date_edit in (self.date_from, self.date_to):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("dd/MM/yyyy")
+            date_edit.setEnabled(False)
+            self.date_range_check.toggled.connect(date_edit.setEnabled)
+        layout.addRow("From:", self.date_from)
+        layout.addRow("To:", self.date_to)
+
+        self.attachments_check = QtWidgets.QCheckBox("Include attached PDFs")
+        layout.addRow(self.attachments_check)
+
+        self.export_button = QtWidgets.QPushButton("Export")
+        self.export_button.clicked.connect(self.accept)
+        layout.addRow(self.export_button)
+
+    def options(self):
+        """Devuelve los parámetros para export_invoices"""
+        year = self.year_combo.currentText()
+        status = self.status_combo.currentText()
+        use_dates = self.date_range_check.isChecked()
+        return {
+            "fmt": self.format_combo.currentText(),
+            "year": None if year == "All" else year,
+            "status": None if status == "All" else status,
+            "date_from": self.date_from.date().toString("yyyy-MM-dd") if use_dates else None,
+            "date_to": self.date_to.date().toString("yyyy-MM-dd") if use_dates else None,
+            "with_attachments": self.attachments_check.isChecked(),
+        }
+
+
 class MainWindow(QtWidgets.QWidget):
+    pdfJobDone = QtCore.pyqtSignal(object, object, object)  # callback, resultado, error del pool de PDFs
+
     def __init__(self):
         super().__init__()
         self.setWindowIcon(QtGui.QIcon(resource_path("icons/app_icon.png")))
@@ -280,6 +414,26 @@ class MainWindow(QtWidgets.QWidget):
         # Cargar íconos
         self.green_check_icon = QtGui.QIcon(resource_path("icons/green_check.png"))
         self.red_cross_icon = QtGui.QIcon(resource_path("icons/red_cross.png"))
+
+        # Pool de hilos para tareas en segundo plano (escaneo de carpetas, etc.)
+        self.thread_pool = QtCore.QThreadPool.globalInstance()
+
+        # Pool de procesos para todo lo que abre PDFs con PyMuPDF: un PDF dañado puede agotar su tiempo
+        # o tumbar un proceso del pool, pero no la aplicación. Los resultados llegan al hilo principal
+        self.pdfJobDone.connect(self.on_pdf_job_done)
+        self.pdf_pool = pdfpool.start_pool(deliver=self.pdfJobDone.emit)
+
+        # Optimización opcional de los PDFs ingresados, en el pool de PDFs
+        self.optimizer = None
+        if pdfopt.is_available():
+            self.optimizer = pdfopt.PDFOptimizer(self.pdf_pool, on_done=self.on_pdf_optimized)
+
+        # Precarga de las facturas vecinas de la seleccionada (listado, primer PDF y miniatura)
+        self.prefetcher = Prefetcher()
+        self.prefetch_timer = QtCore.QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(200)
+        self.prefetch_timer.timeout.connect(self.prefetch_neighbours)
         
         main_layout = QtWidgets.QVBoxLayout(self)
         main_layout.setContentsMargins(15, 15, 15, 15)
@@ -320,7 +474,7 @@ class MainWindow(QtWidgets.QWidget):
         # Selector de año
         year_layout = QtWidgets.QHBoxLayout()
         self.year_combo = QtWidgets.QComboBox()
-        self.year_combo.addItems(["2022", "2023", "2024", "2025"])
+        self.year_combo.addItems(["2022", "2023", "2024", "2025", ALL_YEARS])
         self.year_combo.setCurrentText("2025")  # Por defecto 2025
         self.year_combo.setMinimumWidth(80)
         self.year_combo.setMaximumWidth(100)
@@ -341,6 +495,38 @@ class MainWindow(QtWidgets.QWidget):
         controls_layout.addLayout(search_layout)
         left_panel.addLayout(controls_layout)
 
+        # Barra de filtros: rango de fechas, estado y nombre (consultas indexadas en SQL)
+        dates_layout = QtWidgets.QHBoxLayout()
+        self.filter_dates_check = QtWidgets.QCheckBox("Dates")
+        today = QtCore.QDate.currentDate()
+        self.filter_from = QtWidgets.QDateEdit(QtCore.QDate(today.year(), 1, 1))
+        self.filter_to = QtWidgets.QDateEdit(today)
+        for date_edit in (self.filter_from, self.filter_to):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("dd/MM/yyyy")
+            date_edit.setEnabled(False)
+        self.filter_dates_check.toggled.connect(self.filter_from.setEnabled)
+        self.filter_dates_check.toggled.connect(self.filter_to.setEnabled)
+        dates_layout.addWidget(self.filter_dates_check)
+        dates_layout.addWidget(self.filter_from)
+        dates_layout.addWidget(self.filter_to)
+        left_panel.addLayout(dates_layout)
+
+        filters_layout = QtWidgets.QHBoxLayout()
+        self.filter_status = QtWidgets.QComboBox()
+        self.filter_status.addItem("Any status", None)
+        self.filter_status.addItem("Complete", "completo")
+        self.filter_status.addItem("Incomplete", "incompleto")
+        self.filter_name = QtWidgets.QLineEdit()
+        self.filter_name.setPlaceholderText("Name starts with...")
+        self.filter_btn = QtWidgets.QPushButton("Filter")
+        self.clear_filter_btn = QtWidgets.QPushButton("Clear")
+        filters_layout.addWidget(self.filter_status)
+        filters_layout.addWidget(self.filter_name)
+        filters_layout.addWidget(self.filter_btn)
+        filters_layout.addWidget(self.clear_filter_btn)
+        left_panel.addLayout(filters_layout)
+
         # Tabla
         self.table = QtWidgets.QTableWidget()
         self.table.setColumnCount(5)
@@ -348,7 +534,12 @@ class MainWindow(QtWidgets.QWidget):
         self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
         self.table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
         self.table.verticalHeader().setVisible(False)
-        self.table.horizontalHeader().setVisible(False)  # Ocultar encabezados de columnas
+        # Encabezados visibles para ordenar por número, nombre o fecha (la ordenación se hace en SQL)
+        self.sort_order = ("number", True)
+        self.table.horizontalHeader().setSectionsClickable(True)
+        self.table.horizontalHeader().setSortIndicatorShown(True)
+        self.table.horizontalHeader().setSortIndicator(0, QtCore.Qt.SortOrder.DescendingOrder)
+        self.table.horizontalHeader().sectionClicked.connect(self.on_header_clicked)
         self.table.setColumnHidden(3, True)  # Ocultar Folder (ahora es columna 3)
         header_table = self.table.horizontalHeader()
         header_table.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeMode.Interactive)  # Number
@@ -362,6 +553,17 @@ class MainWindow(QtWidgets.QWidget):
         self.table.setColumnWidth(2, 90)  # Date - ancho moderado
         self.table.setColumnWidth(4, 30)   # Status - muy estrecho solo para icono
         left_panel.addWidget(self.table)
+
+        # Vista de todos los años: [(año, primera fila, filas)] y años ya rellenos (LRU)
+        self.year_segments = []
+        self.loaded_years = OrderedDict()
+        # Filas de la vista por año mostrada (None en búsquedas, filtros y vista de todos los años)
+        self.view_rows = None
+        self.scroll_timer = QtCore.QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(50)
+        self.scroll_timer.timeout.connect(self.fill_visible_years)
+        self.table.verticalScrollBar().valueChanged.connect(lambda _: self.scroll_timer.start())
         
 
         # Botones debajo de la tabla
@@ -371,10 +573,21 @@ class MainWindow(QtWidgets.QWidget):
         self.delete_invoice_btn.setMinimumWidth(120)
         self.btn_open_folder = QtWidgets.QPushButton("Open Folder")
         self.btn_open_folder.setMinimumWidth(120)
+        self.export_btn = QtWidgets.QPushButton("Export")
+        self.check_btn = QtWidgets.QPushButton("Check")
+        self.check_btn.setToolTip("Compare the data folder with the database")
+        self.backup_btn = QtWidgets.QPushButton("Backup")
+        self.backup_btn.setToolTip("Incremental backup of the database and the data folder")
         buttons_layout.addWidget(self.delete_invoice_btn)
         buttons_layout.addWidget(self.btn_open_folder)
         left_panel.addLayout(buttons_layout)
 
+        tools_layout = QtWidgets.QHBoxLayout()
+        tools_layout.addWidget(self.export_btn)
+        tools_layout.addWidget(self.check_btn)
+        tools_layout.addWidget(self.backup_btn)
+        left_panel.addLayout(tools_layout)
+
         self.create_btn = QtWidgets.QPushButton("Create Folder")
         self.create_btn.setMinimumHeight(40)
         left_panel.addWidget(self.create_btn)
@@ -435,6 +648,7 @@ class MainWindow(QtWidgets.QWidget):
         self.pdf_list = QtWidgets.QListWidget()
         self.pdf_list.setMinimumWidth(400)
         self.pdf_list.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
+        self.pdf_list.setIconSize(QtCore.QSize(36, 48))
         self.pdf_list.currentItemChanged.connect(self.show_pdf_in_viewer)
         right_panel.addWidget(self.pdf_list, stretch=1)
 
@@ -447,6 +661,12 @@ class MainWindow(QtWidgets.QWidget):
         self.delete_pdf_btn.setEnabled(False)
         right_panel.addWidget(self.delete_pdf_btn)
 
+        # Combinar todos los PDFs de la factura en uno para imprimir o enviar
+        self.combine_pdfs_btn = QtWidgets.QPushButton("Combine PDFs")
+        self.combine_pdfs_btn.setEnabled(False)
+        self.combine_pdfs_btn.setVisible(printpack.is_available())
+        right_panel.addWidget(self.combine_pdfs_btn)
+
         content_layout.addLayout(right_panel, stretch=1)
 
         # Agregar a layout principal
@@ -473,6 +693,7 @@ class MainWindow(QtWidgets.QWidget):
         """)
 
         self.table.itemSelectionChanged.connect(self.update_delete_invoice_button_state)
+        self.table.itemSelectionChanged.connect(self.schedule_prefetch)
         self.table.itemSelectionChanged.connect(self.update_add_pdf_button_state)
         self.table.itemDoubleClicked.connect(self.toggle_invoice_status)
         self.pdf_list.itemDoubleClicked.connect(self.open_pdf_file)
@@ -480,6 +701,7 @@ class MainWindow(QtWidgets.QWidget):
         self.pdf_list.itemSelectionChanged.connect(self.update_pdf_nav_buttons) 
         self.add_pdf_btn.clicked.connect(self.add_pdf_to_invoice)
         self.delete_pdf_btn.clicked.connect(self.delete_selected_pdf)
+        self.combine_pdfs_btn.clicked.connect(self.combine_invoice_pdfs)
         self.delete_pdf_btn.setStyleSheet("""
             QPushButton {
                 background-color: #d32f2f;  /* rojo */
@@ -497,81 +719,229 @@ class MainWindow(QtWidgets.QWidget):
         """)
         self.search_btn.clicked.connect(self.search_invoices)
         self.search_input.returnPressed.connect(self.search_invoices)
+
+        # Búsqueda mientras se escribe, con un pequeño retardo para agrupar pulsaciones
+        self.invoice_search = InvoiceSearch()
+        self.search_active = False
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.search_invoices)
+        self.search_input.textChanged.connect(lambda _: self.search_timer.start())
+        # Precargar el catálogo de búsqueda en segundo plano para que la primera pulsación sea inmediata
+        self.thread_pool.start(Worker(self.invoice_search.search, ""))
         self.btn_open_folder.clicked.connect(self.open_add_pdfs_dialog)
+        self.export_btn.clicked.connect(self.open_export_dialog)
+        self.check_btn.clicked.connect(self.check_integrity)
+        self.backup_btn.clicked.connect(self.run_backup)
+        self.filter_btn.clicked.connect(self.apply_filters)
+        self.filter_name.returnPressed.connect(self.apply_filters)
+        self.clear_filter_btn.clicked.connect(self.clear_filters)
         
         # Conectar selector de año
         self.year_combo.currentTextChanged.connect(self.on_year_changed)
 
-        # Carga inicial - cargar facturas por año (por defecto 2025)
-        self.load_invoices_by_year()
+        # Carga inicial: la última vista guardada (o el año por defecto, 2025) y validación en segundo plano
+        self.restore_view()
+
+        # Completar en segundo plano los metadatos de los PDFs ya conocidos que aún no los tienen
+        self.thread_pool.start(Worker(manifest.process_pending_metadata))
 
     def format_date_european(self, date_str):
         """Convierte fecha de formato YYYY-MM-DD a DD/MM/YYYY"""
-        if not date_str or len(date_str) < 10:
-            return date_str
-        try:
-            # Si la fecha está en formato YYYY-MM-DD
-            if '-' in date_str and len(date_str) == 10:
-                parts = date_str.split('-')
-                if len(parts) == 3:
-                    year, month, day = parts
-                    return f"{day}/{month}/{year}"
-            # Si ya está en formato DD/MM/YYYY, devolver tal como está
-            elif '/' in date_str:
-                return date_str
-            # Si es solo el año
-            elif len(date_str) == 4 and date_str.isdigit():
-                return date_str
-        except:
-            pass
-        return date_str
-
-
-    def load_invoices(self, invoices=None):
+        return format_date(date_str)
+
+
+    def load_invoices(self, invoices=None, attachment_summary=None):
+        # Las filas llegan ya ordenadas por la consulta indexada (o por la instantánea)
+        self.year_segments = []
+        self.view_rows = None
         self.table.setRowCount(0)
         if invoices is None:
-            invoices = get_invoices()
-        
-        def get_num(i):
-            try:
-                return int(i[1])
-            except:
-                return 0
-        invoices = sorted(invoices, key=get_num, reverse=True)
-
-        for row_data in invoices:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            # La estructura real es: id, number, date, folder, status, name
-            if len(row_data) >= 6:  # Nuevo formato con name
-                number, date, folder, status, name = row_data[1], row_data[2], row_data[3], row_data[4], row_data[5]
-            else:  # Formato antiguo sin name
-                number, date, folder, status, name = row_data[1], row_data[2], row_data[3], row_data[4], ""
-
-            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(number))
-            self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(name if name else ""))
-            self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(self.format_date_european(date)))
-            folder_item = QtWidgets.QTableWidgetItem(folder)
-            self.table.setItem(row, 3, folder_item)
-
-            status_item = QtWidgets.QTableWidgetItem()
-            if status == "completo":
-                status_item.setIcon(self.green_check_icon)
-                status_item.setToolTip("Complete - Double click to change to incomplete")
-            else:
-                status_item.setIcon(self.red_cross_icon)
-                status_item.setToolTip("Incomplete - Double click to change to complete")
-            self.table.setItem(row, 4, status_item)
+            invoices = get_invoices(*self.sort_order)
+        if attachment_summary is None:
+            # Resumen del manifiesto sólo de las carpetas que se muestran
+            attachment_summary = get_attachment_summary(folders=[manifest.folder_key(row[3]) for row in invoices])
+
+        # Reservar todas las filas de una vez y repintar sólo al final
+        self.table.setUpdatesEnabled(False)
+        self.table.setRowCount(len(invoices))
+        for row, row_data in enumerate(invoices):
+            self.set_invoice_row(row, row_data, attachment_summary)
+        self.table.setUpdatesEnabled(True)
 
         if self.table.rowCount() > 0:
             self.table.selectRow(0)
 
+    def set_invoice_row(self, row, row_data, attachment_summary):
+        """Rellena una fila de la tabla con una fila de invoices"""
+        # La estructura real es: id, number, date, folder, status, name
+        if len(row_data) >= 6:  # Nuevo formato con name
+            number, date, folder, status, name = row_data[1], row_data[2], row_data[3], row_data[4], row_data[5]
+        else:  # Formato antiguo sin name
+            number, date, folder, status, name = row_data[1], row_data[2], row_data[3], row_data[4], ""
+
+        self.table.setItem(row, 0, self.make_number_item(number, folder, attachment_summary))
+        self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(name if name else ""))
+        self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(self.format_date_european(date)))
+        self.table.setItem(row, 3, QtWidgets.QTableWidgetItem(folder))
+
+        status_item = QtWidgets.QTableWidgetItem()
+        if status == "completo":
+            status_item.setIcon(self.green_check_icon)
+            status_item.setToolTip("Complete - Double click to change to incomplete")
+        else:
+            status_item.setIcon(self.red_cross_icon)
+            status_item.setToolTip("Incomplete - Double click to change to complete")
+        self.table.setItem(row, 4, status_item)
+
+    def make_number_item(self, number, folder, attachment_summary):
+        """Crea la celda del número con el resumen de PDFs del manifiesto (número, páginas, tamaño) como tooltip"""
+        item = QtWidgets.QTableWidgetItem(number)
+        item.setToolTip(self.summary_tooltip(attachment_summary.get(manifest.folder_key(folder))))
+        return item
+
+    @staticmethod
+    def summary_tooltip(summary):
+        if summary is None:
+            return ""
+        count, pages, size = summary
+        parts = [f"{count} PDF(s)"]
+        if pages:
+            parts.append(f"{pages} pages")
+        if size:
+            parts.append(format_size(size))
+        return " · ".join(parts)
+
+    @staticmethod
+    def pdf_tooltip(entry):
+        """Tooltip de un PDF de la lista con sus metadatos"""
+        lines = [entry["filename"], f"Size: {format_size(entry['size'])}"]
+        if entry["pages"] is not None:
+            lines.append(f"Pages: {entry['pages']}")
+        if entry["created"]:
+            lines.append(f"Created: {entry['created']}")
+        if entry["title"]:
+            lines.append(f"Title: {entry['title']}")
+        if entry["encrypted"]:
+            lines.append("🔒 Encrypted")
+        if entry["damaged"]:
+            lines.append("⚠️ Damaged or unreadable")
+        if not entry["extracted"]:
+            lines.append("Reading metadata...")
+        return "\n".join(lines)
+
     def load_pdfs_for_invoice(self, invoice_folder):
         self.pdf_list.clear()
-        if os.path.exists(invoice_folder):
-            for file in os.listdir(invoice_folder):
-                if file.lower().endswith(".pdf"):
-                    self.pdf_list.addItem(file)
+        entries = manifest.cached_attachments(invoice_folder)
+        if entries:
+            self.populate_pdf_list(entries)
+        self.refresh_manifest_async(invoice_folder)
+
+    def populate_pdf_list(self, entries):
+        """Rellena pdf_list desde el manifiesto conservando el PDF seleccionado si sigue existiendo"""
+        current = self.pdf_list.currentItem()
+        current_name = current.text() if current else None
+        names = [e["filename"] for e in entries]
+        if names == [self.pdf_list.item(i).text() for i in range(self.pdf_list.count())]:
+            # Mismos archivos: sólo actualizar los metadatos
+            self.update_pdf_tooltips(entries)
+            self.update_pdf_thumbnails(entries)
+            return
+        self.pdf_list.blockSignals(True)
+        self.pdf_list.clear()
+        self.pdf_list.addItems(names)
+        self.update_pdf_tooltips(entries)
+        self.update_pdf_thumbnails(entries)
+        self.pdf_list.blockSignals(False)
+        if current_name in names:
+            self.pdf_list.setCurrentRow(names.index(current_name))
+        elif names:
+            # Seleccionar automáticamente el primer PDF
+            self.pdf_list.setCurrentRow(0)
+        else:
+            self.pdf_viewer.setHtml("")
+        self.update_pdf_nav_buttons()
+        self.update_delete_button_state()
+
+    def update_pdf_tooltips(self, entries):
+        for i, entry in enumerate(entries[:self.pdf_list.count()]):
+            item = self.pdf_list.item(i)
+            item.setToolTip(self.pdf_tooltip(entry))
+            if entry["damaged"]:
+                item.setForeground(QtGui.QColor("#d32f2f"))
+
+    def update_pdf_thumbnails(self, entries):
+        """Pone como icono las miniaturas que el precargador ya tiene (sin generarlas aquí)"""
+        folder = self.selected_invoice_folder()
+        if folder is None:
+            return
+        for i, entry in enumerate(entries[:self.pdf_list.count()]):
+            thumbnail = self.prefetcher.get_thumbnail(folder, entry)
+            if thumbnail:
+                pixmap = QtGui.QPixmap()
+                pixmap.loadFromData(thumbnail)
+                self.pdf_list.item(i).setIcon(QtGui.QIcon(pixmap))
+
+    def schedule_prefetch(self):
+        """Cancela la precarga en curso y la reprograma; al desplazarse rápido sólo cuenta la última fila"""
+        self.prefetcher.cancel()
+        self.prefetch_timer.start()
+
+    def prefetch_neighbours(self):
+        """Precarga las facturas de debajo y de encima de la seleccionada"""
+        selected = self.table.selectedItems()
+        if not selected:
+            return
+        row = selected[0].row()
+        folders = []
+        for neighbour in (row + 1, row - 1, row + 2):
+            item = self.table.item(neighbour, 3) if 0 <= neighbour < self.table.rowCount() else None
+            if item is not None:
+                folders.append(item.text())
+        self.prefetcher.prefetch(folders)
+
+    def refresh_manifest_async(self, folder, force=False):
+        """Valida el manifiesto de la carpeta en segundo plano y refresca la lista si ha cambiado"""
+        worker = Worker(manifest.refresh_folder, folder, force)
+        worker.signals.finished.connect(lambda result, folder=folder: self.on_manifest_refreshed(folder, result))
+        worker.signals.error.connect(lambda msg, folder=folder: print(f"Error scanning {folder}: {msg}"))
+        self.thread_pool.start(worker)
+
+    def on_manifest_refreshed(self, folder, result):
+        entries, changed = result
+        # Ignorar resultados de una factura que ya no está seleccionada
+        if self.selected_invoice_folder() != folder:
+            return
+        if changed:
+            self.populate_pdf_list(entries)
+        if any(not e["extracted"] for e in entries):
+            self.extract_metadata_async(folder)
+
+    def extract_metadata_async(self, folder):
+        """Extrae en segundo plano los metadatos pendientes de la carpeta y actualiza lista y tabla"""
+        worker = Worker(manifest.process_pending_metadata, manifest.folder_key(folder), priority=pdfpool.INTERACTIVE)
+        worker.signals.finished.connect(lambda count, folder=folder: self.on_metadata_extracted(folder))
+        worker.signals.error.connect(lambda msg, folder=folder: print(f"Error reading metadata in {folder}: {msg}"))
+        self.thread_pool.start(worker)
+
+    def on_metadata_extracted(self, folder):
+        if self.selected_invoice_folder() != folder:
+            return
+        entries = manifest.cached_attachments(folder)
+        if entries is not None:
+            self.update_pdf_tooltips(entries)
+        selected = self.table.selectedItems()
+        key = manifest.folder_key(folder)
+        number_item = self.table.item(selected[0].row(), 0)
+        number_item.setToolTip(self.summary_tooltip(get_attachment_summary(key).get(key)))
+
+    def selected_invoice_folder(self):
+        """Devuelve la carpeta de la factura seleccionada, o None"""
+        selected = self.table.selectedItems()
+        if not selected:
+            return None
+        return self.table.item(selected[0].row(), 3).text()
 
     def on_invoice_selected(self):
         selected_invoice = self.table.selectedItems()
@@ -580,11 +950,23 @@ class MainWindow(QtWidgets.QWidget):
         folder = self.table.item(selected_invoice[0].row(), 2).text()
         self.load_pdfs_for_invoice(folder)
 
+    def selected_year(self):
+        """Año del selector; en la vista de todos los años, el de la factura seleccionada o el actual"""
+        year = self.year_combo.currentText()
+        if year != ALL_YEARS:
+            return year
+        folder = self.selected_invoice_folder()
+        year = archive.split_folder(folder)[0] if folder else None
+        return year or str(QtCore.QDate.currentDate().year())
+
     def open_create_dialog(self):
         # Pasar el año actualmente seleccionado al diálogo
-        current_year = self.year_combo.currentText()
+        current_year = self.selected_year()
+        if not self.ensure_not_archived(current_year):
+            return
         dialog = InvoiceCreateDialog(current_year)
         dialog.invoiceCreated.connect(self.load_invoices_by_year)  # Recargar vista por año
+        dialog.filesStored.connect(self.optimize_attachments)
         dialog.exec()
 
     def show_invoice_pdfs(self):
@@ -592,21 +974,15 @@ class MainWindow(QtWidgets.QWidget):
         self.pdf_list.clear()
         self.pdf_viewer.setHtml("")  # limpiar visor al cambiar factura
         self.delete_pdf_btn.setEnabled(False)
+        self.combine_pdfs_btn.setEnabled(False)
 
         if not selected:
             return
         
         folder = self.table.item(selected[0].row(), 3).text()  # Folder ahora está en columna 3
 
-        if not os.path.exists(folder):
-            return
-
-        files = [f for f in os.listdir(folder) if f.lower().endswith('.pdf')]
-        self.pdf_list.addItems(files)
-        
-        # Seleccionar automáticamente el primer PDF si hay archivos
-        if files:
-            self.pdf_list.setCurrentRow(0)
+        # Rellenar al instante desde el manifiesto y validar contra el disco en segundo plano
+        self.load_pdfs_for_invoice(folder)
 
     def toggle_invoice_status(self, item):
         # Solo permitir cambio si se hace clic en la columna de estado (columna 4)
@@ -635,12 +1011,31 @@ class MainWindow(QtWidgets.QWidget):
         if not selected_invoice:
             return
         folder = self.table.item(selected_invoice[0].row(), 3).text()  # Folder está en columna 3
-        path = os.path.join(folder, item.text())
-        if os.path.exists(path):
+        path = self.resolve_pdf_path(folder, item.text())
+        if path and os.path.exists(path):
             QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(path))
 
     def update_delete_button_state(self):
         self.delete_pdf_btn.setEnabled(self.pdf_list.currentItem() is not None)
+        self.combine_pdfs_btn.setEnabled(self.pdf_list.count() > 0)
+
+    def combine_invoice_pdfs(self):
+        """Combina los PDFs de la factura (en el orden de la lista) en segundo plano y abre el resultado"""
+        folder = self.selected_invoice_folder()
+        if folder is None or self.pdf_list.count() == 0:
+            return
+        filenames = [self.pdf_list.item(i).text() for i in range(self.pdf_list.count())]
+        self.combine_pdfs_btn.setEnabled(False)
+        self.pdf_pool.submit(printpack.build_pack, folder, filenames, priority=pdfpool.INTERACTIVE,
+                             timeout=printpack.pack_timeout(folder), callback=self.on_pdfs_combined)
+
+    def on_pdfs_combined(self, result, error):
+        self.update_delete_button_state()
+        if error is not None:
+            QtWidgets.QMessageBox.warning(self, "Combine PDFs", f"Could not combine the PDFs:\n{error}")
+            return
+        path, _ = result
+        QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(path))
 
     def delete_selected_pdf(self):
         selected_invoice = self.table.selectedItems()
@@ -649,42 +1044,101 @@ class MainWindow(QtWidgets.QWidget):
             return
         
         folder = self.table.item(selected_invoice[0].row(), 3).text()
-        path = os.path.join(folder, selected_pdf.text())
+        if not self.ensure_not_archived(archive.split_folder(folder)[0]):
+            return
 
         reply = QtWidgets.QMessageBox.question(self, "Delete PDF", f"Are you sure you want to delete '{selected_pdf.text()}'?",
                                                QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No)
         if reply == QtWidgets.QMessageBox.StandardButton.Yes:
             try:
-                os.remove(path)
+                get_storage().delete(folder, selected_pdf.text())
+                invalidate_folder_manifest(manifest.folder_key(folder))
                 self.pdf_list.takeItem(self.pdf_list.currentRow())
                 self.pdf_viewer.setHtml("")  # limpiar visor si borró el pdf mostrado
             except Exception as e:
                 QtWidgets.QMessageBox.warning(self, "Error", f"Could not delete file:\n{str(e)}")
 
     def search_invoices(self):
+        self.search_timer.stop()
         text = self.search_input.text().strip().lower()
         if not text:
-            self.load_invoices_by_year()  # Cargar vista por año cuando no hay búsqueda
+            # Cargar vista por año cuando no hay búsqueda (sólo si se estaba mostrando una búsqueda)
+            if self.search_active:
+                self.search_active = False
+                self.load_invoices_by_year()
             return
         
-        # Buscar en todas las facturas de la base de datos
-        invoices = get_invoices()
-        filtered_invoices = []
-        
-        for invoice in invoices:
-            # La estructura real es: id, number, date, folder, status, name
-            number, date, folder, status = invoice[1], invoice[2], invoice[3], invoice[4]
-            name = invoice[5] if len(invoice) >= 6 else ""  # Manejar facturas sin campo name
-            
-            # Buscar en número de factura, fecha o nombre
-            if (text in number.lower() or 
-                text in date.lower() or 
-                (name and text in name.lower())):
-                filtered_invoices.append(invoice)
+        # Buscar en número de factura, fecha o nombre (refinando resultados anteriores si es posible)
+        filtered_invoices = self.invoice_search.search(text)
+        self.search_active = True
         
         # Mostrar resultados filtrados
         self.load_invoices(filtered_invoices)
 
+    def current_filters(self):
+        """Filtros de la barra como argumentos de filter_invoices() (vacío si no hay ninguno)."""
+        filters = {}
+        if self.filter_dates_check.isChecked():
+            filters["date_from"] = self.filter_from.date().toString("yyyy-MM-dd")
+            filters["date_to"] = self.filter_to.date().toString("yyyy-MM-dd")
+        if self.filter_status.currentData():
+            filters["status"] = self.filter_status.currentData()
+        name = self.filter_name.text().strip()
+        if name:
+            filters["name"] = name
+        return filters
+
+    def apply_filters(self):
+        """Muestra las facturas que cumplen los filtros, ordenadas por fecha (de la más reciente)."""
+        filters = self.current_filters()
+        if not filters:
+            self.load_invoices_by_year()
+            return
+        year = self.year_combo.currentText()
+        if year != ALL_YEARS:
+            filters["year"] = year
+        self.pdf_list.clear()
+        sort, descending = self.sort_order
+        self.load_invoices(filter_invoices(sort=sort, descending=descending, **filters))
+        self.search_active = True
+
+    def clear_filters(self):
+        self.filter_dates_check.setChecked(False)
+        self.filter_status.setCurrentIndex(0)
+        self.filter_name.clear()
+        self.load_invoices_by_year()
+
+    def on_header_clicked(self, column):
+        """Ordena la vista actual por la columna pulsada; un segundo clic invierte el sentido"""
+        if column not in SORTABLE_COLUMNS:
+            # Mantener el indicador en la columna por la que realmente se ordena
+            self.update_sort_indicator()
+            return
+        sort, descending = SORTABLE_COLUMNS[column]
+        if self.sort_order[0] == sort:
+            descending = not self.sort_order[1]
+        self.sort_order = (sort, descending)
+        self.invoice_search.set_order(sort, descending)
+        self.update_sort_indicator()
+        self.reload_view()
+
+    def update_sort_indicator(self):
+        sort, descending = self.sort_order
+        column = next(c for c, (name, _) in SORTABLE_COLUMNS.items() if name == sort)
+        order = QtCore.Qt.SortOrder.DescendingOrder if descending else QtCore.Qt.SortOrder.AscendingOrder
+        self.table.horizontalHeader().setSortIndicator(column, order)
+
+    def reload_view(self):
+        """Vuelve a consultar la vista actual (búsqueda, filtros o año) con el orden actual"""
+        selected_folder = self.selected_invoice_folder()
+        if self.search_input.text().strip():
+            self.search_invoices()
+        elif self.search_active and self.current_filters():
+            self.apply_filters()
+        else:
+            self.load_invoices_by_year()
+        self.select_invoice_folder(selected_folder)
+
     def update_delete_invoice_button_state(self):
         # Activa o desactiva el botón eliminar factura según selección
         selected = self.table.selectedItems()
@@ -698,6 +1152,8 @@ class MainWindow(QtWidgets.QWidget):
         row = selected[0].row()
         number = self.table.item(row, 0).text()
         folder = self.table.item(row, 3).text()
+        if not self.ensure_not_archived(archive.split_folder(folder)[0]):
+            return
         
         reply = QtWidgets.QMessageBox.question(
             self, "Delete Invoice",
@@ -706,13 +1162,14 @@ class MainWindow(QtWidgets.QWidget):
         )
         if reply == QtWidgets.QMessageBox.StandardButton.Yes:
             try:
-                # Borra carpeta completa
-                if os.path.exists(folder):
-                    shutil.rmtree(folder)
-                
-                # Aquí debes borrar la factura de la base de datos
+                # Primero la base de datos: si después falla el borrado de la carpeta, queda una
+                # carpeta huérfana que la comprobación de integridad detecta y puede volver a dar de alta
                 from db import delete_invoice
                 delete_invoice(number)
+                delete_folder_manifest(manifest.folder_key(folder))
+
+                # Borra carpeta completa
+                get_storage().delete_folder(folder)
                 
                 QtWidgets.QMessageBox.information(self, "Deleted", f"Invoice '{number}' deleted successfully.")
                 self.load_invoices_by_year()  # Recargar vista por año
@@ -732,7 +1189,10 @@ class MainWindow(QtWidgets.QWidget):
             QtWidgets.QMessageBox.warning(self, "Error", "Selected row has no folder information.")
             return
         invoice_folder_name = invoice_folder_name.strip()
-        invoice_folder = invoice_folder_name
+        invoice_folder = get_storage().folder_path(invoice_folder_name)
+        if not invoice_folder:
+            QtWidgets.QMessageBox.warning(self, "Error", "This invoice is not stored in a folder on disk.")
+            return
         if not os.path.exists(invoice_folder):
             QtWidgets.QMessageBox.warning(self, "Error", f"Invoice folder not found:\n{invoice_folder}")
             return
@@ -757,10 +1217,10 @@ class MainWindow(QtWidgets.QWidget):
 
         folder = self.table.item(selected_invoice[0].row(), 3).text()
         pdf_file = current.text()
-        path = os.path.join(folder, pdf_file)
-        abs_path = os.path.abspath(path)
+        path = self.resolve_pdf_path(folder, pdf_file)
+        abs_path = os.path.abspath(path) if path else None
 
-        if os.path.exists(abs_path):
+        if abs_path and os.path.exists(abs_path):
             pdfjs_viewer_path = resource_path(os.path.join("viewer", "web", "viewer.html"))
             if os.path.exists(pdfjs_viewer_path):
                 viewer_url = QUrl.fromLocalFile(pdfjs_viewer_path)
@@ -774,6 +1234,182 @@ class MainWindow(QtWidgets.QWidget):
         else:
             self.pdf_viewer.setHtml("<h3 style='color:white;text-align:center'>📄 Archivo PDF no encontrado</h3>")
 
+    def open_export_dialog(self):
+        """Pide filtros y destino y exporta el catálogo en segundo plano con barra de progreso"""
+        years = [self.year_combo.itemText(i) for i in range(self.year_combo.count())
+                 if self.year_combo.itemText(i) != ALL_YEARS]
+        dialog = ExportDialog(years, self.year_combo.currentText())
+        if dialog.exec() != QtWidgets.QDialog.DialogCode.Accepted:
+            return
+        options = dialog.options()
+        fmt = options["fmt"]
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export Invoices", f"invoices.{fmt}", f"{fmt.upper()} Files (*.{fmt})"
+        )
+        if not path:
+            return
+
+        cancel_event = threading.Event()
+        progress_dialog = QtWidgets.QProgressDialog("Exporting invoices...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Export")
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        progress_dialog.canceled.connect(cancel_event.set)
+        progress_dialog.show()
+
+        def on_progress(done, total):
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(done)
+
+        def on_finished(count):
+            progress_dialog.reset()
+            QtWidgets.QMessageBox.information(self, "Export", f"{count} invoice(s) exported to:\n{path}")
+
+        def on_error(message):
+            progress_dialog.reset()
+            if not cancel_event.is_set():
+                QtWidgets.QMessageBox.warning(self, "Error", f"Could not export invoices:\n{message}")
+
+        worker = Worker(export_invoices, path, cancel_event=cancel_event, report_progress=True, **options)
+        worker.signals.progress.connect(on_progress)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.error.connect(on_error)
+        self.thread_pool.start(worker)
+
+    def run_backup(self):
+        """Copia de seguridad incremental en segundo plano; la aplicación sigue utilizable mientras tanto"""
+        target = QtWidgets.QFileDialog.getExistingDirectory(self, "Backup Folder", os.path.abspath(backup.BACKUP_DIR))
+        if not target:
+            return
+
+        cancel_event = threading.Event()
+        progress_dialog = QtWidgets.QProgressDialog("Backing up...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Backup")
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModality.NonModal)
+        progress_dialog.canceled.connect(cancel_event.set)
+        progress_dialog.show()
+        self.backup_btn.setEnabled(False)
+
+        def on_progress(done, total):
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(done)
+
+        def on_finished(result):
+            path, copied, linked = result
+            progress_dialog.reset()
+            self.backup_btn.setEnabled(True)
+            QtWidgets.QMessageBox.information(
+                self, "Backup", f"Backup saved to:\n{path}\n\n{copied} file(s) copied, {linked} unchanged."
+            )
+
+        def on_error(message):
+            progress_dialog.reset()
+            self.backup_btn.setEnabled(True)
+            if not cancel_event.is_set():
+                QtWidgets.QMessageBox.warning(self, "Error", f"Could not create the backup:\n{message}")
+
+        worker = Worker(backup.run_backup, target, cancel_event=cancel_event, report_progress=True)
+        worker.signals.progress.connect(on_progress)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.error.connect(on_error)
+        self.thread_pool.start(worker)
+
+    def check_integrity(self):
+        """Reconcilia data/ con la base de datos en segundo plano y muestra el informe"""
+        self.check_btn.setEnabled(False)
+        worker = Worker(reconcile.reconcile)
+        worker.signals.finished.connect(self.on_integrity_checked)
+        worker.signals.error.connect(self.on_integrity_failed)
+        self.thread_pool.start(worker)
+
+    def on_integrity_checked(self, report):
+        self.check_btn.setEnabled(True)
+        box = QtWidgets.QMessageBox(self)
+        box.setWindowTitle("Integrity Check")
+        box.setText(reconcile.format_report(report).split("\n", 1)[0])
+        box.setDetailedText(reconcile.format_report(report))
+        fix_button = None
+        if reconcile.has_fixes(report):
+            box.setInformativeText("Fix adds folders missing from the database (incomplete, without date) and, "
+                                   "after confirmation, removes invoices without folder. Duplicates and "
+                                   "unreadable PDFs are only reported.")
+            fix_button = box.addButton("Fix", QtWidgets.QMessageBox.ButtonRole.AcceptRole)
+        box.addButton(QtWidgets.QMessageBox.StandardButton.Close)
+        box.exec()
+        if fix_button is not None and box.clickedButton() == fix_button:
+            added, deleted = reconcile.fix(report, delete=self.confirm_integrity_deletions(report))
+            QtWidgets.QMessageBox.information(self, "Integrity Check",
+                                              f"{added} invoices added, {deleted} removed.")
+            self.load_invoices_by_year()
+
+    def confirm_integrity_deletions(self, report):
+        """Pide confirmar las facturas que Fix va a borrar; False si no hay que borrar ninguna"""
+        rows = [f"{number}: {folder}" for _, number, folder in report["missing"]]
+        rows += [f"{folder}: {len(ids) - 1} repeated rows" for folder, ids in report["repeated"].items()]
+        if not rows:
+            return False
+        problem = reconcile.deletion_problem(report)
+        if problem:
+            QtWidgets.QMessageBox.warning(self, "Integrity Check",
+                                          f"No invoices will be removed.\n{problem}\n\nMissing folders are still added.")
+            return False
+        box = QtWidgets.QMessageBox(self)
+        box.setWindowTitle("Integrity Check")
+        box.setText(f"Remove these {len(rows)} invoice entries from the database?")
+        box.setDetailedText("\n".join(rows))
+        box.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No)
+        box.setDefaultButton(QtWidgets.QMessageBox.StandardButton.No)
+        return box.exec() == QtWidgets.QMessageBox.StandardButton.Yes
+
+    def on_integrity_failed(self, message):
+        self.check_btn.setEnabled(True)
+        QtWidgets.QMessageBox.warning(self, "Integrity Check", f"Could not check the data folder:\n{message}")
+
+    def resolve_pdf_path(self, folder, filename):
+        """Ruta local de un PDF; si no se guarda como archivo suelto (paquete, blob) se extrae sólo ese PDF"""
+        try:
+            return get_storage().local_path(folder, filename)
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Error reading {filename} from storage: {e}")
+            return None
+
+    def ensure_not_archived(self, year):
+        """Avisa y devuelve False si el año está archivado (sólo lectura)"""
+        if year is None or not archive.is_archived(year):
+            return True
+        QtWidgets.QMessageBox.warning(
+            self, "Archived Year",
+            f"Year {year} is archived and read-only.\nUnpack it first with: python archive.py unpack {year}"
+        )
+        return False
+
+    def optimize_attachments(self, folder, filenames):
+        """Encola los PDFs recién copiados para optimizarlos en segundo plano (si está activado)"""
+        if self.optimizer is None:
+            return
+        for filename in filenames:
+            try:
+                self.optimizer.submit(folder, filename)
+            except Exception as e:
+                print(f"Error queueing {filename} for optimization: {e}")
+
+    def on_pdf_optimized(self, folder, filename, size_before, size_after, replaced):
+        if not replaced:
+            return
+        print(f"Optimized {filename}: {size_before // 1024} KB -> {size_after // 1024} KB")
+        invalidate_folder_manifest(manifest.folder_key(folder))
+        if self.selected_invoice_folder() == folder:
+            self.refresh_manifest_async(folder, force=True)
+
+    def on_pdf_job_done(self, callback, result, error):
+        """Entrega en el hilo principal el resultado de un trabajo del pool de PDFs"""
+        callback(result, error)
+
+    def closeEvent(self, event):
+        self.save_view()
+        self.prefetcher.shutdown()
+        pdfpool.stop_pool()
+        super().closeEvent(event)
+
     def update_pdf_nav_buttons(self):
         total = self.pdf_list.count()
         current_row = self.pdf_list.currentRow()
@@ -801,90 +1437,206 @@ class MainWindow(QtWidgets.QWidget):
     def load_invoices_by_year(self):
         """Carga las facturas únicamente desde la carpeta del año seleccionado"""
         selected_year = self.year_combo.currentText()
-        year_folder = os.path.join("data", selected_year)
+        if selected_year == ALL_YEARS:
+            self.load_all_years()
+            return
+        self.search_active = False
+        self.year_segments = []
         
         self.table.setRowCount(0)
+        self.view_rows = None
         
-        if not os.path.exists(year_folder):
+        if not get_storage().has_year(selected_year):
             self.pdf_viewer.setHtml(f"<h3 style='color:#666;text-align:center'>No hay carpeta para el año {selected_year}</h3>")
             return
         
-        invoices_data = []
-        
         try:
-            # Obtener todas las carpetas de facturas del año
-            for invoice_folder_name in os.listdir(year_folder):
-                invoice_path = os.path.join(year_folder, invoice_folder_name)
-                if os.path.isdir(invoice_path):
-                    # Buscar información en la base de datos para obtener fecha, nombre y estado reales
-                    all_invoices = get_invoices()
-                    invoice_name = ""  # Por defecto vacío
-                    invoice_date = selected_year  # Por defecto usar el año
-                    invoice_status = "completo"  # Por defecto completo para facturas externas
-                    
-                    # Buscar en la BD si existe información adicional
-                    for db_invoice in all_invoices:
-                        if db_invoice[1] == invoice_folder_name:  # Coincidir por número de factura
-                            # La estructura real es: id, number, date, folder, status, name
-                            if len(db_invoice) >= 6:  # Nuevo formato con name
-                                invoice_date = db_invoice[2]  # date está en índice 2
-                                invoice_status = db_invoice[4]  # status está en índice 4
-                                invoice_name = db_invoice[5] if db_invoice[5] else ""  # name está en índice 5
-                            else:  # Formato antiguo sin name
-                                invoice_date = db_invoice[2]
-                                invoice_status = db_invoice[4]
-                            break
-                    
-                    invoice_data = {
-                        'number': invoice_folder_name,
-                        'name': invoice_name,
-                        'date': invoice_date,
-                        'folder': invoice_path,
-                        'status': invoice_status
-                    }
-                    invoices_data.append(invoice_data)
+            # Carpetas del año (del índice del paquete si está archivado) con los datos de la BD
+            rows = snapshot.year_rows(selected_year, *self.sort_order)
         except Exception as e:
-            print(f"Error loading invoices from {year_folder}: {e}")
+            print(f"Error loading invoices from {os.path.join('data', selected_year)}: {e}")
             return
         
         # Si no hay datos, mostrar mensaje
-        if not invoices_data:
+        if not rows:
             self.pdf_viewer.setHtml(f"<h3 style='color:#666;text-align:center'>No hay facturas en la carpeta {selected_year}</h3>")
             return
         
-        # Ordenar las facturas por número
+        self.show_year_rows(rows)
+
+    def show_year_rows(self, rows, attachment_summary=None):
+        """Muestra las filas de la vista por año y las recuerda para la instantánea"""
+        self.load_invoices(rows, attachment_summary)
+        self.view_rows = rows
+
+    def restore_view(self):
+        """
+        Arranque: muestra al instante la última vista guardada y la contrasta en segundo plano
+        con la BD y el disco, aplicando sólo las diferencias.
+        """
+        view = snapshot.load_snapshot()
+        if view is None or self.year_combo.findText(view["year"]) < 0:
+            self.load_invoices_by_year()
+            return
+        self.year_combo.blockSignals(True)
+        self.year_combo.setCurrentText(view["year"])
+        self.year_combo.blockSignals(False)
+        if view["sort"] in SORT_COLUMNS:
+            self.sort_order = (view["sort"], view["descending"])
+            self.invoice_search.set_order(*self.sort_order)
+            self.update_sort_indicator()
+        if view["year"] == ALL_YEARS or not view["rows"]:
+            self.load_invoices_by_year()
+            return
+
+        # Primero las filas, sin tocar la BD; los tooltips del número se rellenan en segundo plano
+        self.show_year_rows(view["rows"], attachment_summary={})
+        self.select_invoice_folder(view["selected_folder"])
+        self.table.verticalScrollBar().setValue(view["scroll"])
+        tooltips = Worker(get_attachment_summary, folders=[manifest.folder_key(row[3]) for row in view["rows"]])
+        tooltips.signals.finished.connect(lambda summary, year=view["year"]: self.fill_number_tooltips(year, summary))
+        tooltips.signals.error.connect(lambda msg: print(f"Error reading the attachment summary: {msg}"))
+        self.thread_pool.start(tooltips)
+        worker = Worker(snapshot.year_rows, view["year"], *self.sort_order)
+        worker.signals.finished.connect(lambda rows, year=view["year"]: self.on_year_rows_refreshed(year, rows))
+        worker.signals.error.connect(lambda msg: print(f"Error refreshing the view: {msg}"))
+        self.thread_pool.start(worker)
+
+    def fill_number_tooltips(self, year, attachment_summary):
+        """Completa los tooltips del número que la vista restaurada dejó vacíos"""
+        # Ignorar si entretanto se ha cambiado de año o se está mostrando una búsqueda
+        if self.view_rows is None or self.year_combo.currentText() != year:
+            return
+        for row in range(self.table.rowCount()):
+            item, folder_item = self.table.item(row, 0), self.table.item(row, 3)
+            if item is None or folder_item is None or item.toolTip():
+                continue
+            item.setToolTip(self.summary_tooltip(attachment_summary.get(manifest.folder_key(folder_item.text()))))
+
+    def on_year_rows_refreshed(self, year, rows):
+        # Ignorar si entretanto se ha cambiado de año o se está mostrando una búsqueda
+        if self.view_rows is None or self.year_combo.currentText() != year:
+            return
+        self.apply_year_rows(rows)
+
+    def apply_year_rows(self, rows):
+        """Actualiza la tabla de la vista por año tocando sólo las filas que han cambiado"""
+        old_rows = self.view_rows or []
+        if rows == old_rows:
+            return
+        selected_folder = self.selected_invoice_folder()
+        matcher = difflib.SequenceMatcher(None, old_rows, rows, autojunk=False)
+        opcodes = matcher.get_opcodes()
+        # Resumen del manifiesto sólo de las filas que se van a escribir
+        attachment_summary = get_attachment_summary(folders=[
+            manifest.folder_key(rows[j][3]) for tag, _, _, j1, j2 in opcodes if tag != "equal" for j in range(j1, j2)
+        ])
+
+        self.table.setUpdatesEnabled(False)
+        self.table.blockSignals(True)
+        # De atrás hacia delante para que los índices de los tramos pendientes sigan siendo válidos
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag == "equal":
+                continue
+            common = min(i2 - i1, j2 - j1)
+            for k in range(common):
+                self.set_invoice_row(i1 + k, rows[j1 + k], attachment_summary)
+            for row in reversed(range(i1 + common, i2)):
+                self.table.removeRow(row)
+            for k in range(common, j2 - j1):
+                self.table.insertRow(i1 + k)
+                self.set_invoice_row(i1 + k, rows[j1 + k], attachment_summary)
+        self.table.blockSignals(False)
+        self.table.setUpdatesEnabled(True)
+
+        self.view_rows = rows
+        if not self.select_invoice_folder(selected_folder) and self.table.rowCount() > 0:
+            self.table.selectRow(0)
+
+    def select_invoice_folder(self, folder):
+        """Selecciona la fila de la carpeta indicada. Devuelve False si no está en la tabla."""
+        for row in range(self.table.rowCount()):
+            item = self.table.item(row, 3)
+            if item is not None and item.text() == folder:
+                if self.selected_invoice_folder() != folder:
+                    self.table.selectRow(row)
+                return True
+        return False
+
+    def save_view(self):
+        """Guarda la vista actual para el próximo arranque (las búsquedas y filtros no se guardan)"""
+        year = self.year_combo.currentText()
+        rows = None if year == ALL_YEARS else self.view_rows
         try:
-            invoices_data.sort(key=lambda x: int(x['number']) if x['number'].isdigit() else 0, reverse=True)
-        except:
-            invoices_data.sort(key=lambda x: x['number'], reverse=True)
-        
-        # Llenar la tabla con los datos
-        for invoice_data in invoices_data:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            
-            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(invoice_data['number']))
-            self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(invoice_data['name']))  # Usar el nombre de la BD
-            self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(self.format_date_european(invoice_data['date'])))
-            self.table.setItem(row, 3, QtWidgets.QTableWidgetItem(invoice_data['folder']))
-            
-            # Icono de estado
-            status_item = QtWidgets.QTableWidgetItem()
-            if invoice_data['status'] == "completo":
-                status_item.setIcon(self.green_check_icon)
-                status_item.setToolTip("Complete - Double click to change to incomplete")
+            snapshot.save_snapshot(year, rows, self.selected_invoice_folder(),
+                                   self.table.verticalScrollBar().value(), self.sort_order)
+        except Exception as e:
+            print(f"Error saving the view snapshot: {e}")
+
+    def load_all_years(self):
+        """
+        Vista de todos los años: reserva una fila por factura (recuentos de la BD y del manifiesto)
+        y rellena cada año sólo cuando entra en la zona visible de la tabla.
+        """
+        self.search_active = False
+        self.table.setRowCount(0)
+        self.year_segments = []
+        self.loaded_years = OrderedDict()
+        total = 0
+        for year, count in get_year_counts():
+            self.year_segments.append((year, total, count))
+            total += count
+        if not total:
+            self.pdf_viewer.setHtml("<h3 style='color:#666;text-align:center'>No hay facturas</h3>")
+            return
+        self.table.setRowCount(total)
+        self.fill_visible_years()
+        self.table.selectRow(0)
+
+    def fill_visible_years(self):
+        """Rellena los años visibles y vacía los menos usados por encima de MAX_LOADED_YEARS"""
+        if not self.year_segments:
+            return
+        first = max(self.table.rowAt(0), 0)
+        last = self.table.rowAt(self.table.viewport().height() - 1)
+        if last < 0:
+            last = self.table.rowCount() - 1
+        keep = set()
+        for year, start, count in self.year_segments:
+            if start > last or start + count <= first:
+                continue
+            keep.add(year)
+            if year in self.loaded_years:
+                self.loaded_years.move_to_end(year)
             else:
-                status_item.setIcon(self.red_cross_icon)
-                status_item.setToolTip("Incomplete - Double click to change to complete")
-            self.table.setItem(row, 4, status_item)
-        
-        # Seleccionar la primera fila si hay datos
-        if self.table.rowCount() > 0:
-            self.table.selectRow(0)
-    
+                self.fill_year(year, start, count)
+                self.loaded_years[year] = (start, count)
+
+        # No vaciar el año de la factura seleccionada aunque ya no se vea
+        selected = self.table.selectedItems()
+        if selected:
+            row = selected[0].row()
+            keep.update(y for y, start, count in self.year_segments if start <= row < start + count)
+        for year in [y for y in self.loaded_years if y not in keep]:
+            if len(self.loaded_years) <= MAX_LOADED_YEARS:
+                break
+            start, count = self.loaded_years.pop(year)
+            for row in range(start, start + count):
+                for column in range(self.table.columnCount()):
+                    self.table.takeItem(row, column)
+
+    def fill_year(self, year, start, count):
+        """Rellena las filas reservadas para un año con sus facturas, ordenadas por número"""
+        invoices = get_year_invoices(year, *self.sort_order, limit=count)
+        attachment_summary = get_attachment_summary(year=year)
+        self.table.setUpdatesEnabled(False)
+        for offset, row_data in enumerate(invoices):
+            self.set_invoice_row(start + offset, row_data, attachment_summary)
+        self.table.setUpdatesEnabled(True)
+
     def get_selected_year_folder(self):
         """Retorna la carpeta del año actualmente seleccionado"""
-        return os.path.join("data", self.year_combo.currentText())
+        return os.path.join("data", self.selected_year())
 
     def update_add_pdf_button_state(self):
         """Activa o desactiva el botón Add PDF to Invoice según si hay una factura seleccionada"""
@@ -901,8 +1653,11 @@ class MainWindow(QtWidgets.QWidget):
         # Obtener la carpeta de la factura seleccionada
         folder = self.table.item(selected_invoice[0].row(), 3).text()
         invoice_number = self.table.item(selected_invoice[0].row(), 0).text()
+        if not self.ensure_not_archived(archive.split_folder(folder)[0]):
+            return
         
-        if not os.path.exists(folder):
+        storage = get_storage()
+        if not storage.folder_exists(folder):
             QtWidgets.QMessageBox.warning(self, "Error", f"Invoice folder not found:\n{folder}")
             return
         
@@ -920,13 +1675,13 @@ class MainWindow(QtWidgets.QWidget):
         # Copiar archivos seleccionados a la carpeta de la factura
         copied_count = 0
         skipped_files = []
+        stored = []
         
         for file_path in files:
             filename = os.path.basename(file_path)
-            dest_path = os.path.join(folder, filename)
             
             # Verificar si el archivo ya existe
-            if os.path.exists(dest_path):
+            if storage.exists(folder, filename):
                 reply = QtWidgets.QMessageBox.question(
                     self, "File Exists", 
                     f"The file '{filename}' already exists in the invoice folder.\n\nDo you want to overwrite it?",
@@ -941,13 +1696,17 @@ class MainWindow(QtWidgets.QWidget):
             
             # Copiar el archivo
             try:
-                shutil.copy(file_path, dest_path)
+                storage.put(folder, filename, file_path)
                 copied_count += 1
+                stored.append(filename)
             except Exception as e:
                 QtWidgets.QMessageBox.warning(self, "Error Copying File", f"Could not copy '{filename}':\n{str(e)}")
         
         # Actualizar la lista de PDFs y mostrar mensaje de resultado
+        # (forzar escaneo: sobrescribir un PDF no cambia el mtime de la carpeta)
+        invalidate_folder_manifest(manifest.folder_key(folder))
         self.show_invoice_pdfs()
+        self.optimize_attachments(folder, stored)
         
         message = f"Successfully added {copied_count} PDF(s) to invoice '{invoice_number}'."
         if skipped_files:
@@ -957,6 +1716,7 @@ class MainWindow(QtWidgets.QWidget):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Necesario para los procesos del pool en el ejecutable de PyInstaller
     init_db()
     app = QtWidgets.QApplication(sys.argv)
     window = MainWindow()
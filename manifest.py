@@ -0,0 +1,186 @@
+import os
+import hashlib
+
+import pdfpool
+from db import (get_folder_manifest, save_folder_manifest, get_pending_metadata,
+                save_attachment_metadata, ATTACHMENT_FIELDS)
+from storage import get_storage
+
+try:
+    import fitz  # PyMuPDF, para los metadatos de los PDFs
+except ImportError:
+    fitz = None
+
+METADATA_BATCH_SIZE = 50
+
+
+def folder_key(folder):
+    """Normaliza la ruta de una carpeta para usarla como clave del manifiesto."""
+    return os.path.normpath(folder)
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Calcula el SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pdf_date(value):
+    """Convierte una fecha PDF (D:AAAAMMDDHHmmSS...) a 'AAAA-MM-DD HH:MM', o None."""
+    if not value:
+        return None
+    digits = value[2:] if value.startswith("D:") else value
+    digits = digits[:12]
+    if len(digits) < 8 or not digits.isdigit():
+        return None
+    text = f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]}"
+    if len(digits) >= 12:
+        text += f" {digits[8:10]}:{digits[10:12]}"
+    return text
+
+
+def read_pdf_info(path=None, data=None):
+    """
+    Extrae páginas, fecha de creación, título y si el PDF está cifrado o dañado.
+    Sin PyMuPDF sólo se comprueba la cabecera del archivo.
+    """
+    info = {"pages": None, "created": None, "title": None, "encrypted": 0, "damaged": 0}
+    if fitz is None:
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read(1024)
+        info["damaged"] = int(b"%PDF-" not in data[:1024])
+        return info
+    try:
+        doc = fitz.open(path) if path else fitz.open(stream=data, filetype="pdf")
+    except Exception:
+        info["damaged"] = 1
+        return info
+    with doc:
+        info["encrypted"] = int(bool(doc.needs_pass or doc.is_encrypted))
+        if not doc.needs_pass:
+            info["pages"] = doc.page_count
+            metadata = doc.metadata or {}
+            info["title"] = metadata.get("title") or None
+            info["created"] = _pdf_date(metadata.get("creationDate"))
+        info["damaged"] = int(bool(doc.is_repaired))
+    return info
+
+
+def extract_metadata(folder, filename):
+    """Calcula los metadatos y el hash de un PDF a través del almacenamiento."""
+    storage = get_storage()
+    path = storage.path(folder, filename)
+    if path:
+        info = read_pdf_info(path=path)
+        info["hash"] = file_hash(path)
+    else:
+        data = storage.get(folder, filename)
+        info = read_pdf_info(data=data)
+        info["hash"] = hashlib.sha256(data).hexdigest()
+    return info
+
+
+def process_pending_metadata(folder=None, batch_size=METADATA_BATCH_SIZE, limit=None, priority=pdfpool.BATCH):
+    """
+    Extrae por lotes los metadatos de los adjuntos que aún no los tienen (de una carpeta o de todas).
+    Cada archivo se procesa una sola vez por versión (tamaño + mtime). Devuelve cuántos se han procesado.
+    Si el pool de PDFs está arrancado, cada PDF se abre en uno de sus procesos con esa prioridad;
+    un PDF que lo cuelga o lo tumba queda marcado como dañado.
+    """
+    pool = pdfpool.get_pool()
+    done = 0
+    while limit is None or done < limit:
+        pending = get_pending_metadata(batch_size, folder)
+        if not pending:
+            break
+        results = []
+        for pending_folder, filename, size, mtime_ns in pending:
+            try:
+                if pool is not None:
+                    meta = pool.run(extract_metadata, pending_folder, filename, priority=priority)
+                else:
+                    meta = extract_metadata(pending_folder, filename)
+            except pdfpool.PoolClosed:
+                # La aplicación se está cerrando: lo que falta sigue pendiente para la próxima vez
+                save_attachment_metadata(results)
+                return done + len(results)
+            except Exception:
+                # Archivo desaparecido o ilegible (o su trabajo se ha colgado o ha tumbado el proceso):
+                # se marca como dañado hasta el próximo escaneo
+                meta = {"damaged": 1}
+            results.append((pending_folder, filename, size, mtime_ns, meta))
+        save_attachment_metadata(results)
+        done += len(results)
+    return done
+
+
+def cached_attachments(folder):
+    """Devuelve la lista de adjuntos guardada en el manifiesto (sin tocar el disco), o None."""
+    _, entries = get_folder_manifest(folder_key(folder))
+    return entries
+
+
+def folder_mtime(folder):
+    """mtime de la carpeta según el almacenamiento; None si no existe."""
+    return get_storage().folder_mtime(folder)
+
+
+def is_stale(folder):
+    """Compara el mtime de la carpeta con el guardado. Un solo stat, sin listar la carpeta."""
+    stored_mtime, _ = get_folder_manifest(folder_key(folder))
+    return stored_mtime != folder_mtime(folder)
+
+
+def _new_entry(filename, size, mtime_ns):
+    entry = dict.fromkeys(ATTACHMENT_FIELDS)
+    entry.update(filename=filename, size=size, mtime_ns=mtime_ns, extracted=0)
+    return entry
+
+
+def _scan(folder, known):
+    """Lista la carpeta; los archivos nuevos o modificados quedan pendientes de extraer metadatos."""
+    entries = []
+    for filename, size, mtime_ns in get_storage().list(folder):
+        old = known.get(filename)
+        if old and old["size"] == size and old["mtime_ns"] == mtime_ns:
+            entries.append(old)
+        else:
+            entries.append(_new_entry(filename, size, mtime_ns))
+    return entries
+
+
+def refresh_folder(folder, force=False):
+    """
+    Vuelve a escanear la carpeta si su mtime ha cambiado (o si force=True).
+    Reutiliza los metadatos de los archivos cuyo tamaño y mtime no han cambiado; los demás
+    se extraen después con process_pending_metadata.
+    Devuelve (adjuntos, cambiado).
+
+    El mtime de la carpeta solo cambia al crear, borrar o renombrar archivos; tras
+    sobrescribir un PDF en su sitio hay que llamar con force=True.
+    """
+    key = folder_key(folder)
+    stored_mtime, previous = get_folder_manifest(key)
+    current_mtime = folder_mtime(folder)
+    if current_mtime is None:
+        # La carpeta ya no existe: el manifiesto queda vacío
+        if previous:
+            save_folder_manifest(key, None, [])
+            return [], True
+        return [], False
+
+    if not force and previous is not None and stored_mtime == current_mtime:
+        return previous, False
+
+    known = {e["filename"]: e for e in previous or []}
+    entries = _scan(folder, known)
+    entries.sort(key=lambda e: e["filename"].lower())
+
+    changed = [(e["filename"], e["size"], e["mtime_ns"]) for e in entries] != \
+        [(e["filename"], e["size"], e["mtime_ns"]) for e in previous or []]
+    save_folder_manifest(key, current_mtime, entries)
+    return entries, changed or previous is None
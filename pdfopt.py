@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import pdfpool
+from db import record_pdf_optimization
+from storage import get_storage
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+# Etapa opcional: se activa con INVOICE_OPTIMIZE_PDFS=1. Las imágenes por encima de
+# INVOICE_OPTIMIZE_MAX_DPI se reducen a esa resolución (0 = no reducir imágenes).
+OPTIMIZE_ENABLED = os.environ.get("INVOICE_OPTIMIZE_PDFS", "0") == "1"
+MAX_DPI = int(os.environ.get("INVOICE_OPTIMIZE_MAX_DPI", "150"))
+
+
+def _downsample_images(doc, max_dpi):
+    """Reduce las imágenes que se muestran por encima de max_dpi. Devuelve cuántas se han reducido."""
+    done = set()
+    for page in doc:
+        for image in page.get_images(full=True):
+            xref, smask = image[0], image[1]
+            if xref in done or smask:
+                # Las imágenes con máscara de transparencia se dejan como están
+                continue
+            rects = page.get_image_rects(xref)
+            if not rects:
+                continue
+            width_pt = max(r.width for r in rects)
+            if width_pt <= 0:
+                continue
+            pix = fitz.Pixmap(doc, xref)
+            dpi = pix.width / (width_pt / 72)
+            if dpi <= max_dpi:
+                continue
+            scale = max_dpi / dpi
+            if pix.alpha or pix.colorspace is None or pix.colorspace.n not in (1, 3):
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            small = fitz.Pixmap(pix, max(int(pix.width * scale), 1), max(int(pix.height * scale), 1), None)
+            page.replace_image(xref, pixmap=small)
+            done.add(xref)
+    return len(done)
+
+
+def optimize_file(src_path, dst_path, max_dpi=0):
+    """
+    Escribe en dst_path una versión optimizada de src_path: recolección de objetos no usados,
+    compresión deflate de los streams y, si max_dpi > 0, reducción de imágenes.
+    Devuelve (tamaño_original, tamaño_optimizado).
+    """
+    with fitz.open(src_path) as doc:
+        if doc.needs_pass:
+            raise ValueError("PDF cifrado")
+        if max_dpi:
+            _downsample_images(doc, max_dpi)
+        doc.save(dst_path, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+    return os.path.getsize(src_path), os.path.getsize(dst_path)
+
+
+def optimize_attachment(folder, filename, max_dpi=0):
+    """
+    Optimiza un adjunto y sustituye el original sólo si el resultado es más pequeño y el archivo
+    no ha cambiado entretanto. Se ejecuta en un proceso del pool de PDFs, así que un PDF dañado
+    nunca llega a tocar el original. Devuelve (antes, después, sustituido).
+    """
+    storage = get_storage()
+    signature = next(((size, mtime) for name, size, mtime in storage.list(folder) if name == filename), None)
+    tmp_dir = tempfile.mkdtemp(prefix="pdfopt_")
+    try:
+        src_path = storage.path(folder, filename)
+        if src_path is None:
+            # Backends sin archivo suelto: trabajar sobre una copia local
+            src_path = os.path.join(tmp_dir, "src.pdf")
+            shutil.copy(storage.local_path(folder, filename), src_path)
+        dst_path = os.path.join(tmp_dir, "optimized.pdf")
+        before, after = optimize_file(src_path, dst_path, max_dpi)
+        replaced = False
+        if after < before:
+            current = [(size, mtime) for name, size, mtime in storage.list(folder) if name == filename]
+            if current == [signature]:
+                path = storage.path(folder, filename)
+                if path:
+                    # Copiar junto al original y sustituirlo de forma atómica
+                    shutil.copyfile(dst_path, path + ".opt")
+                    os.replace(path + ".opt", path)
+                else:
+                    storage.put(folder, filename, dst_path)
+                replaced = True
+        record_pdf_optimization(folder, filename, before, after, replaced)
+        return before, after, replaced
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class PDFOptimizer:
+    """
+    Cola de optimización de PDFs recién ingresados sobre el pool de PDFs compartido (prioridad baja).
+    on_done(carpeta, archivo, antes, después, sustituido) se llama donde el pool entrega los resultados
+    (en la aplicación, el hilo principal).
+    """
+
+    def __init__(self, pool, max_dpi=MAX_DPI, on_done=None):
+        self.pool = pool
+        self.max_dpi = max_dpi
+        self.on_done = on_done
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, folder, filename):
+        """Encola un PDF; ignora los que ya están en cola."""
+        key = (folder, filename)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        try:
+            self.pool.submit(optimize_attachment, folder, filename, self.max_dpi, priority=pdfpool.BATCH,
+                             callback=lambda result, error: self._finish(folder, filename, result, error))
+        except Exception:
+            # Sin encolar (p. ej. pool cerrado): que se pueda volver a intentar
+            with self._lock:
+                self._pending.discard(key)
+            raise
+
+    def _finish(self, folder, filename, result, error):
+        with self._lock:
+            self._pending.discard((folder, filename))
+        if error is not None:
+            print(f"Error optimizing {os.path.join(folder, filename)}: {error}")
+        elif self.on_done:
+            self.on_done(folder, filename, *result)
+
+
+def is_available():
+    """La etapa de optimización está activada y PyMuPDF instalado."""
+    return OPTIMIZE_ENABLED and fitz is not None
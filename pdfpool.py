@@ -0,0 +1,294 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+try:
+    import resource  # Límite de memoria de los procesos (sólo POSIX)
+except ImportError:
+    resource = None
+
+# Servicio compartido para todo el trabajo con PyMuPDF sobre PDFs que pueden venir dañados o ser
+# hostiles: cada trabajo se ejecuta en un proceso aparte con tiempo y memoria limitados. Si el proceso
+# se cuelga, se queda sin memoria o muere, se sustituye y sólo falla ese trabajo.
+MAX_WORKERS = int(os.environ.get("INVOICE_PDF_WORKERS", "2"))
+JOB_TIMEOUT = float(os.environ.get("INVOICE_PDF_TIMEOUT", "60"))
+MEMORY_LIMIT = int(os.environ.get("INVOICE_PDF_MEMORY_MB", "1024")) * 1024 * 1024  # 0 = sin límite
+
+# Prioridades: lo que el usuario está esperando pasa por delante de lo que se hace en segundo plano
+INTERACTIVE = 0
+BATCH = 10
+
+
+class PDFJobError(Exception):
+    """Un trabajo del pool ha fallado, ha agotado su tiempo o su proceso ha muerto."""
+
+
+class PoolClosed(PDFJobError):
+    """El pool se ha cerrado antes de terminar el trabajo: no dice nada del PDF."""
+
+
+def _worker_main(conn, memory_limit):
+    """Bucle de un proceso del pool: recibe (función, argumentos) y devuelve (ok, resultado o error)."""
+    if memory_limit and resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError):
+            pass
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        fn, args = job
+        try:
+            result = (True, fn(*args))
+        except MemoryError:
+            result = (False, "Memoria agotada procesando el PDF")
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {e}")
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send((False, f"Resultado no válido: {e}"))
+
+
+class Job:
+    """Trabajo encolado. cancel() lo descarta si todavía no ha empezado."""
+
+    def __init__(self, fn, args, priority, timeout, callback, direct):
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.timeout = timeout
+        self.callback = callback
+        self.direct = direct
+        self.cancelled = False
+        self.aborted = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Worker:
+    def __init__(self):
+        self.process = None
+        self.conn = None
+        self.job = None
+        self.deadline = None
+
+
+class PDFWorkerPool:
+    """
+    Pool de procesos para PyMuPDF con cola de prioridad, tiempo máximo por trabajo, límite de memoria
+    por proceso y reinicio automático de los procesos que se cuelgan o mueren.
+    callback(resultado, error) se entrega a través de deliver(callback, resultado, error); la aplicación
+    pasa una señal de Qt para recibirlo en el hilo principal. Sin deliver se llama desde el hilo del pool.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, timeout=JOB_TIMEOUT, memory_limit=MEMORY_LIMIT, deliver=None):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.deliver = deliver
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_Worker() for _ in range(max(max_workers, 1))]
+        self._queue = []  # (prioridad, orden, trabajo)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = multiprocessing.Pipe(duplex=False)
+        self._closed = False
+        self.restarts = 0
+        self._thread = threading.Thread(target=self._run, name="pdfpool", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, priority=BATCH, timeout=None, callback=None):
+        """
+        Encola fn(*args) en un proceso del pool. fn debe ser una función de módulo (se envía por pickle).
+        Devuelve el Job, que se puede cancelar mientras no haya empezado.
+        """
+        return self._submit(Job(fn, args, priority, timeout, callback, direct=False))
+
+    def run(self, fn, *args, priority=BATCH, timeout=None):
+        """
+        Versión bloqueante de submit() para hilos de fondo. Lanza PDFJobError si el trabajo falla,
+        o PoolClosed si el pool se cierra antes de que termine.
+        """
+        done = threading.Event()
+        outcome = {}
+
+        def finished(result, error):
+            outcome.update(result=result, error=error)
+            done.set()
+
+        job = self._submit(Job(fn, args, priority, timeout, finished, direct=True))
+        done.wait()
+        if job.aborted:
+            raise PoolClosed(outcome["error"])
+        if outcome["error"] is not None:
+            raise PDFJobError(outcome["error"])
+        return outcome["result"]
+
+    def _submit(self, job):
+        with self._lock:
+            if self._closed:
+                raise PoolClosed("El pool de PDFs está cerrado")
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+        self._wake_w.send(None)
+        return job
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for _, _, job in self._queue if not job.cancelled)
+
+    def _start(self, worker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        worker.process = self._ctx.Process(target=_worker_main, args=(child_conn, self.memory_limit),
+                                           name="pdfpool-worker", daemon=True)
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+
+    def _stop(self, worker):
+        """Mata el proceso de un trabajador; se arranca otro cuando haga falta."""
+        if worker.process is not None:
+            worker.process.kill()
+            worker.process.join(5)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = worker.conn = None
+
+    def _dispatch(self):
+        """Asigna los trabajos de mayor prioridad a los procesos libres."""
+        for worker in self._workers:
+            if worker.job is not None:
+                continue
+            with self._lock:
+                job = None
+                while self._queue:
+                    _, _, candidate = heapq.heappop(self._queue)
+                    if not candidate.cancelled:
+                        job = candidate
+                        break
+            if job is None:
+                return
+            try:
+                if worker.process is None or not worker.process.is_alive():
+                    self._stop(worker)
+                    self._start(worker)
+                worker.conn.send((job.fn, job.args))
+            except Exception as e:
+                self._stop(worker)
+                self._finish(job, None, f"No se ha podido enviar el trabajo: {e}")
+                continue
+            worker.job = job
+            worker.deadline = time.monotonic() + (job.timeout if job.timeout is not None else self.timeout)
+
+    def _finish(self, job, result, error):
+        if job.callback is None:
+            if error is not None:
+                print(f"PDF job {getattr(job.fn, '__name__', job.fn)} failed: {error}")
+            return
+        try:
+            if job.direct or self.deliver is None:
+                job.callback(result, error)
+            else:
+                self.deliver(job.callback, result, error)
+        except Exception as e:
+            print(f"Error delivering PDF job result: {e}")
+
+    def _run(self):
+        while True:
+            self._dispatch()
+            busy = [w for w in self._workers if w.job is not None]
+            now = time.monotonic()
+            timeout = max(min(w.deadline for w in busy) - now, 0) if busy else None
+            ready = wait([self._wake_r] + [w.conn for w in busy], timeout)
+            if self._closed:
+                break
+            for conn in ready:
+                if conn is self._wake_r:
+                    while self._wake_r.poll():
+                        self._wake_r.recv()
+                    continue
+                worker = next(w for w in busy if w.conn is conn)
+                job, worker.job = worker.job, None
+                try:
+                    ok, value = conn.recv()
+                except (EOFError, OSError):
+                    # El proceso ha muerto (fallo de PyMuPDF, memoria, señal...)
+                    worker.process.join(1)
+                    code = worker.process.exitcode
+                    self._stop(worker)
+                    self.restarts += 1
+                    self._finish(job, None, f"El proceso del PDF ha terminado de forma inesperada (código {code})")
+                    continue
+                self._finish(job, value if ok else None, None if ok else value)
+
+            now = time.monotonic()
+            for worker in busy:
+                if worker.job is not None and worker.deadline <= now:
+                    job, worker.job = worker.job, None
+                    self._stop(worker)
+                    self.restarts += 1
+                    self._finish(job, None, "Tiempo agotado procesando el PDF")
+
+    def shutdown(self):
+        """
+        Cierra el pool: los trabajos pendientes se descartan y los que están en curso se abortan.
+        Las llamadas a run() que esperaban reciben PoolClosed.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            queued, self._queue = self._queue, []
+        self._wake_w.send(None)
+        self._thread.join(5)
+        aborted = [job for _, _, job in queued]
+        for worker in self._workers:
+            if worker.job is None and worker.conn is not None:
+                try:
+                    worker.conn.send(None)
+                    worker.process.join(1)
+                except OSError:
+                    pass
+            elif worker.job is not None:
+                aborted.append(worker.job)
+                worker.job = None
+            self._stop(worker)
+        for job in aborted:
+            job.cancel()
+            job.aborted = True
+            if job.direct:
+                self._finish(job, None, "El pool de PDFs se ha cerrado")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_pool(**kwargs):
+    """Arranca el pool compartido de la aplicación (una sola vez) y lo devuelve."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PDFWorkerPool(**kwargs)
+        return _pool
+
+
+def get_pool():
+    """Pool compartido, o None si no se ha arrancado (scripts y procesos del propio pool)."""
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import manifest
+import pdfpool
+from storage import get_storage
+
+try:
+    import fitz  # PyMuPDF, para las miniaturas
+except ImportError:
+    fitz = None
+
+# Tamaño máximo de los PDFs de los que se genera miniatura
+MAX_FILE_BYTES = 8 * 1024 * 1024
+THUMBNAIL_WIDTH = 96
+MAX_THUMBNAILS = 256
+
+
+def render_thumbnail(data, width=THUMBNAIL_WIDTH):
+    """PNG de la primera página con el ancho dado, o None si no se puede leer."""
+    try:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            if doc.needs_pass or doc.page_count == 0:
+                return None
+            page = doc[0]
+            zoom = width / max(page.rect.width, 1)
+            return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+    except Exception:
+        return None
+
+
+class Prefetcher:
+    """
+    Precarga en segundo plano las facturas vecinas de la seleccionada: valida su manifiesto
+    (listado de la carpeta), deja el primer PDF en disco para el visor (paquetes y blobs) y genera
+    su miniatura. Usa un único hilo propio para no competir con el pool de la selección actual,
+    y cada llamada a prefetch() cancela lo que quedaba pendiente de la anterior.
+    """
+
+    def __init__(self, max_file_bytes=MAX_FILE_BYTES, thumbnail_width=THUMBNAIL_WIDTH, max_workers=1):
+        self.max_file_bytes = max_file_bytes
+        self.thumbnail_width = thumbnail_width
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+        self._thumbnails = OrderedDict()  # (carpeta, archivo, tamaño, mtime_ns) -> PNG
+
+    @staticmethod
+    def _key(folder, entry):
+        return manifest.folder_key(folder), entry["filename"], entry["size"], entry["mtime_ns"]
+
+    def prefetch(self, folders):
+        """Cancela las precargas pendientes y encola las carpetas dadas, en orden de prioridad."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            for future in self._futures:
+                future.cancel()
+            self._futures = [self.executor.submit(self._warm, folder, generation)
+                             for folder in folders if folder]
+
+    def cancel(self):
+        """Cancela las precargas pendientes; la que está en curso se detiene en el siguiente paso."""
+        self.prefetch([])
+
+    def _cancelled(self, generation):
+        return generation != self._generation
+
+    def _warm(self, folder, generation):
+        if self._cancelled(generation):
+            return
+        entries, _ = manifest.refresh_folder(folder)
+        if not entries or self._cancelled(generation):
+            return
+        entry = entries[0]
+        key = self._key(folder, entry)
+        storage = get_storage()
+        if storage.path(folder, entry["filename"]) is None:
+            # Paquetes y blobs: dejar el PDF ya extraído para el visor
+            storage.local_path(folder, entry["filename"])
+        if self._cancelled(generation):
+            return
+
+        if fitz is None or entry["size"] is None or entry["size"] > self.max_file_bytes:
+            return
+        with self._lock:
+            if key in self._thumbnails:
+                return
+        thumbnail = self.render_thumbnail(storage.get(folder, entry["filename"]))
+        if thumbnail is not None:
+            with self._lock:
+                self._thumbnails[key] = thumbnail
+                while len(self._thumbnails) > MAX_THUMBNAILS:
+                    self._thumbnails.popitem(last=False)
+
+    def render_thumbnail(self, data):
+        """PNG de la primera página, en un proceso del pool de PDFs si está arrancado; None si falla."""
+        pool = pdfpool.get_pool()
+        if pool is None:
+            return render_thumbnail(data, self.thumbnail_width)
+        try:
+            return pool.run(render_thumbnail, data, self.thumbnail_width, priority=pdfpool.BATCH)
+        except pdfpool.PDFJobError:
+            return None
+
+    def get_thumbnail(self, folder, entry):
+        """Miniatura PNG precargada de un adjunto del manifiesto, o None."""
+        with self._lock:
+            return self._thumbnails.get(self._key(folder, entry))
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
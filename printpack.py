@@ -0,0 +1,167 @@
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import tempfile
+import argparse
+import queue
+
+import manifest
+import pdfpool
+from archive import split_folder
+from storage import get_storage
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "invoice_manager_printpacks")
+MAX_WORKERS = 2
+# Tiempo máximo de un paquete en el pool de PDFs: una base más un margen por MB de adjuntos,
+# para que un paquete grande pero válido no se confunda con un PDF colgado
+PACK_TIMEOUT = float(os.environ.get("INVOICE_PACK_TIMEOUT", "300"))
+PACK_SECONDS_PER_MB = 2
+
+
+def pack_key(folder, entries):
+    """Clave del paquete: carpeta y nombre, tamaño y mtime de cada adjunto, en orden."""
+    digest = hashlib.sha256(manifest.folder_key(folder).encode("utf-8"))
+    for entry in entries:
+        digest.update(f"\x00{entry['filename']}\x00{entry['size']}\x00{entry['mtime_ns']}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def cache_folder(folder):
+    """Carpeta de caché de los paquetes de una factura (una versión por clave)."""
+    year, number = split_folder(folder)
+    if year is None:
+        year, number = "_", hashlib.sha256(manifest.folder_key(folder).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, year, number)
+
+
+def merge_pdfs(folder, filenames, dst_path=None):
+    """
+    Concatena los PDFs de la carpeta en el orden dado. Escribe en dst_path, o devuelve
+    los bytes del documento si dst_path es None. Los PDFs cifrados no se pueden combinar.
+    """
+    storage = get_storage()
+    with fitz.open() as merged:
+        for filename in filenames:
+            path = storage.path(folder, filename)
+            src = fitz.open(path) if path else fitz.open(stream=storage.get(folder, filename), filetype="pdf")
+            with src:
+                if src.needs_pass:
+                    raise ValueError(f"PDF cifrado: {filename}")
+                merged.insert_pdf(src)
+        if dst_path is None:
+            return merged.tobytes(garbage=3, deflate=True)
+        merged.save(dst_path, garbage=3, deflate=True)
+    return dst_path
+
+
+def build_pack(folder, filenames=None):
+    """
+    Devuelve la ruta del PDF combinado de la factura (adjuntos en el orden de la lista, o en el
+    dado). Se reutiliza el paquete en caché mientras ningún adjunto cambie de nombre, tamaño o mtime.
+    Devuelve (ruta, reutilizado).
+    """
+    # Forzado: un PDF sobrescrito en su sitio no cambia el mtime de la carpeta, y la clave del
+    # paquete debe ver su nuevo tamaño y mtime
+    entries, _ = manifest.refresh_folder(folder, force=True)
+    if filenames is not None:
+        by_name = {e["filename"]: e for e in entries}
+        entries = [by_name[name] for name in filenames if name in by_name]
+    if not entries:
+        raise FileNotFoundError(f"No hay PDFs en {folder}")
+
+    directory = cache_folder(folder)
+    path = os.path.join(directory, pack_key(folder, entries) + ".pdf")
+    if os.path.exists(path):
+        return path, True
+
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".part"
+    merge_pdfs(folder, [e["filename"] for e in entries], tmp_path)
+    os.replace(tmp_path, path)
+    # Las versiones anteriores de esta factura ya no sirven
+    for old in glob.glob(os.path.join(directory, "*.pdf")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path, False
+
+
+def pack_timeout(folder):
+    """Tiempo máximo para generar el paquete de una factura según el tamaño de sus adjuntos (manifiesto)."""
+    entries = manifest.cached_attachments(folder) or []
+    size_mb = sum(e["size"] or 0 for e in entries) / (1024 * 1024)
+    return PACK_TIMEOUT + size_mb * PACK_SECONDS_PER_MB
+
+
+def build_year_packs(year, max_workers=MAX_WORKERS, progress=None):
+    """
+    Genera los paquetes de todas las facturas de un año en un pool de PDFs propio (un PDF dañado
+    sólo hace fallar su factura). progress(hechos, total) se llama tras cada factura.
+    Devuelve (generados, reutilizados, errores), con errores como [(carpeta, mensaje)].
+    """
+    storage = get_storage()
+    folders = [os.path.join("data", str(year), number) for number in storage.list_folders(str(year))]
+    results = queue.Queue()
+    pool = pdfpool.PDFWorkerPool(max_workers=max_workers)
+    try:
+        for folder in folders:
+            pool.submit(build_pack, folder, timeout=pack_timeout(folder),
+                        callback=lambda result, error, folder=folder: results.put((folder, result, error)))
+        built, reused, errors = 0, 0, []
+        for done in range(1, len(folders) + 1):
+            folder, result, error = results.get()
+            if error is not None:
+                errors.append((folder, error))
+            elif result[1]:
+                reused += 1
+            else:
+                built += 1
+            if progress:
+                progress(done, len(folders))
+    finally:
+        pool.shutdown()
+    return built, reused, errors
+
+
+def is_available():
+    return fitz is not None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combina los PDFs de una factura en un único documento.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    one = sub.add_parser("build", help="Paquete de una factura")
+    one.add_argument("folder", help="Carpeta de la factura (data/<año>/<número>)")
+    one.add_argument("-o", "--output", help="Copiar el paquete a esta ruta")
+    year = sub.add_parser("year", help="Paquetes de todas las facturas de un año")
+    year.add_argument("year")
+    year.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    if fitz is None:
+        print("PyMuPDF no está instalado (pip install pymupdf)")
+        return 1
+    if args.action == "build":
+        path, reused = build_pack(args.folder)
+        if args.output:
+            path = shutil.copyfile(path, args.output)
+        print(f"{path}{' (caché)' if reused else ''}")
+    else:
+        built, reused, errors = build_year_packs(args.year, args.workers)
+        print(f"{built} paquetes generados, {reused} reutilizados, {len(errors)} errores")
+        for folder, message in errors:
+            print(f"  {folder}: {message}")
+    return 1 if args.action == "year" and errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import os
+import sys
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import archive
+import manifest
+from db import (init_db, get_invoice_locations, get_folder_mtimes, get_damaged_attachments,
+                apply_reconciliation)
+from storage import get_storage, DATA_DIR
+
+MAX_WORKERS = 4
+# Más bajas que esto en una sola corrección suelen indicar que data/ no es la carpeta correcta
+MAX_FIX_DELETIONS = 50
+
+
+class FixRefused(Exception):
+    """La corrección borraría facturas con un informe que no es fiable."""
+
+
+def _scan_year(year, known_mtimes):
+    """
+    Lista las carpetas de factura de un año y vuelve a revisar (listado y metadatos de los PDFs)
+    sólo las que han cambiado desde la última vez. Devuelve ({carpeta: mtime_ns}, revisadas).
+    """
+    storage = get_storage()
+    folders = {}
+    if storage.name == "folder" and not archive.is_archived(year):
+        with os.scandir(os.path.join(DATA_DIR, year)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    folders[manifest.folder_key(entry.path)] = entry.stat().st_mtime_ns
+    else:
+        for number in storage.list_folders(year):
+            folder = manifest.folder_key(os.path.join(DATA_DIR, year, number))
+            folders[folder] = storage.folder_mtime(folder)
+
+    checked = 0
+    for folder, mtime_ns in folders.items():
+        if known_mtimes.get(folder) != mtime_ns:
+            manifest.refresh_folder(folder)
+            manifest.process_pending_metadata(folder)
+            checked += 1
+    return folders, checked
+
+
+def reconcile(max_workers=MAX_WORKERS, progress=None):
+    """
+    Compara data/ con la base de datos. Los años se recorren en paralelo y sólo se revisan a fondo
+    las carpetas cuyo mtime ha cambiado desde el último escaneo (el manifiesto guarda ese mtime).
+    progress(hechos, total) se llama tras cada año. Devuelve un informe (dict) con:
+      orphans: carpetas sin factura en la BD
+      missing: [(id, número, carpeta)] facturas cuya carpeta no existe
+      duplicates: {número: [carpetas]} números presentes en más de una carpeta
+      repeated: {carpeta: [ids]} facturas repetidas que apuntan a la misma carpeta
+      unreadable: [(carpeta, archivo)] PDFs que no se pueden leer
+      folders, checked: carpetas encontradas y carpetas revisadas
+      years, failed_years: años encontrados y [(año, error)] de los que no se han podido leer
+    """
+    storage = get_storage()
+    years = storage.list_years()
+    known_mtimes = get_folder_mtimes()
+    on_disk = {}
+    checked = 0
+    failed_years = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_scan_year, year, known_mtimes): year for year in years}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                folders, count = future.result()
+            except Exception as e:
+                failed_years.append((futures[future], str(e)))
+            else:
+                on_disk.update(folders)
+                checked += count
+            if progress:
+                progress(done, len(years))
+
+    # Una sola pasada por la BD: facturas por carpeta y carpetas por número
+    by_folder = defaultdict(list)
+    locations = defaultdict(set)
+    for invoice_id, number, folder in get_invoice_locations():
+        key = manifest.folder_key(folder)
+        by_folder[key].append((invoice_id, number, folder))
+        locations[number].add(key)
+    for folder in on_disk:
+        locations[os.path.basename(folder)].add(folder)
+
+    missing = [row for folder, rows in by_folder.items()
+               if folder not in on_disk and not storage.folder_exists(folder)
+               for row in rows]
+
+    return {
+        "orphans": sorted(folder for folder in on_disk if folder not in by_folder),
+        "missing": missing,
+        "duplicates": {number: sorted(folders) for number, folders in locations.items() if len(folders) > 1},
+        "repeated": {folder: [row[0] for row in rows] for folder, rows in by_folder.items() if len(rows) > 1},
+        "unreadable": [(folder, filename) for folder, filename in get_damaged_attachments() if folder in on_disk],
+        "folders": len(on_disk),
+        "checked": checked,
+        "years": years,
+        "failed_years": sorted(failed_years),
+    }
+
+
+def _delete_ids(report):
+    ids = {invoice_id for invoice_id, _, _ in report["missing"]}
+    for repeated in report["repeated"].values():
+        ids.update(sorted(repeated)[1:])
+    return ids
+
+
+def deletion_problem(report, max_deletions=MAX_FIX_DELETIONS):
+    """
+    Motivo por el que no se deben borrar facturas con este informe, o None. Sin años en data/ o con
+    algún año ilegible (unidad de red desconectada, carpeta de trabajo equivocada...) todas sus
+    facturas parecerían no tener carpeta.
+    """
+    if not report["years"]:
+        return "No year folders were found in data/. Is the data folder reachable?"
+    if report["failed_years"]:
+        return "Some year folders could not be read: " + ", ".join(year for year, _ in report["failed_years"])
+    count = len(_delete_ids(report))
+    if max_deletions is not None and count > max_deletions:
+        return f"{count} invoices would be removed, more than the limit of {max_deletions}."
+    return None
+
+
+def fix(report, delete=True, max_deletions=MAX_FIX_DELETIONS):
+    """
+    Corrige en una sola transacción lo que tiene arreglo automático: da de alta las carpetas huérfanas
+    (salvo si su número ya existe en otra carpeta) y, con delete=True, borra las facturas sin carpeta y
+    las filas repetidas de una misma carpeta (se conserva la más antigua). Los duplicados entre años y
+    los PDFs ilegibles sólo se informan. Lanza FixRefused si hay que borrar y deletion_problem() lo
+    desaconseja (max_deletions=None quita el límite de bajas). Devuelve (altas, bajas).
+    """
+    delete_ids = _delete_ids(report) if delete else set()
+    if delete_ids:
+        problem = deletion_problem(report, max_deletions)
+        if problem:
+            raise FixRefused(problem)
+    add = []
+    for folder in report["orphans"]:
+        year, number = archive.split_folder(folder)
+        if year is None or number in report["duplicates"]:
+            continue
+        # Nadie ha revisado estas carpetas: sin fecha y pendientes de completar
+        add.append((number, "", folder, "incompleto"))
+    drop_manifests = [manifest.folder_key(folder) for _, _, folder in report["missing"]] if delete_ids else []
+    apply_reconciliation(add, delete_ids, drop_manifests)
+    return len(add), len(delete_ids)
+
+
+def format_report(report):
+    """Texto del informe para la consola o el diálogo de la aplicación."""
+    lines = [f"{report['folders']} folders in {len(report['years'])} years ({report['checked']} rechecked)"]
+    lines += [f"  Could not read {year}: {error}" for year, error in report["failed_years"]]
+    lines += [
+        f"{len(report['orphans'])} folders without invoice in the database"]
+    lines += [f"  {folder}" for folder in report["orphans"]]
+    lines.append(f"{len(report['missing'])} invoices whose folder does not exist")
+    lines += [f"  {number}: {folder}" for _, number, folder in report["missing"]]
+    lines.append(f"{len(report['duplicates'])} invoice numbers in more than one folder")
+    lines += [f"  {number}: {', '.join(folders)}" for number, folders in report["duplicates"].items()]
+    lines.append(f"{len(report['repeated'])} folders with repeated invoice rows")
+    lines += [f"  {folder}: {len(ids)} rows" for folder, ids in report["repeated"].items()]
+    lines.append(f"{len(report['unreadable'])} unreadable PDFs")
+    lines += [f"  {os.path.join(folder, filename)}" for folder, filename in report["unreadable"]]
+    return "\n".join(lines)
+
+
+def has_fixes(report):
+    return bool(report["orphans"] or report["missing"] or report["repeated"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara data/ con la base de datos y opcionalmente la corrige.")
+    parser.add_argument("--fix", action="store_true", help="Aplicar las correcciones automáticas")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Años que se recorren a la vez")
+    parser.add_argument("--max-deletions", type=int, default=MAX_FIX_DELETIONS,
+                        help="Máximo de facturas que --fix puede borrar (-1 sin límite)")
+    args = parser.parse_args(argv)
+    init_db()
+    report = reconcile(args.workers)
+    print(format_report(report))
+    if args.fix and has_fixes(report):
+        try:
+            added, deleted = fix(report, max_deletions=None if args.max_deletions < 0 else args.max_deletions)
+        except FixRefused as e:
+            print(f"No se borra ninguna factura: {e}")
+            return 1
+        print(f"{added} facturas añadidas, {deleted} eliminadas")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from db import DB_NAME, natural_key, order_by
+
+CACHE_SIZE = 32
+
+
+def invoice_number_key(row):
+    """Clave de orden natural por número de factura ("25-A" va justo después de "25")."""
+    return natural_key(row[1])
+
+
+class InvoiceSearch:
+    """
+    Búsqueda incremental sobre el catálogo de facturas (número, fecha y nombre).
+
+    El catálogo se lee una vez, ya ordenado por SQL, y se guarda en memoria con el texto de búsqueda
+    en minúsculas. Si una consulta contiene a otra ya resuelta ("25" -> "250"), sólo se filtra
+    el resultado anterior en lugar de todo el catálogo. Los resultados recientes se guardan en
+    una caché LRU que se vacía cuando cambian las facturas: PRAGMA data_version detecta las
+    escrituras hechas desde cualquier otra conexión y, sólo entonces, se mira el contador de la tabla
+    invoices (invoices_version, mantenido por triggers), para no descartar nada por las escrituras
+    del manifiesto y de los metadatos.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE, db_name=DB_NAME):
+        self.cache_size = cache_size
+        self._conn = sqlite3.connect(db_name, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._invoices_version = None
+        self._catalog = None  # [(texto_en_minúsculas, fila)]
+        self._cache = OrderedDict()  # consulta -> [(texto_en_minúsculas, fila)]
+        self._order = ("number", True)
+
+    def set_order(self, sort="number", descending=True):
+        """Cambia el orden de los resultados (number, name o date); el catálogo se vuelve a leer."""
+        with self._lock:
+            if (sort, descending) != self._order:
+                self._order = (sort, descending)
+                self._catalog = None
+                self._cache.clear()
+
+    def invalidate(self):
+        """Descarta el catálogo y los resultados guardados."""
+        with self._lock:
+            self._catalog = None
+            self._cache.clear()
+
+    def _check_version(self):
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        try:
+            version = self._conn.execute("SELECT version FROM invoices_version").fetchone()
+        except sqlite3.OperationalError:
+            version = None  # BD sin el contador: cualquier escritura invalida
+        if version is None or version != self._invoices_version:
+            self._invoices_version = version
+            self._catalog = None
+            self._cache.clear()
+
+    def _load_catalog(self):
+        rows = self._conn.execute("SELECT * FROM invoices" + order_by(*self._order)).fetchall()
+        # La estructura real es: id, number, date, folder, status, name
+        return [(f"{r[1]}\x00{r[2]}\x00{r[5] if len(r) >= 6 and r[5] else ''}".lower(), r) for r in rows]
+
+    def search(self, text):
+        """Devuelve las filas de invoices que contienen el texto en número, fecha o nombre."""
+        query = text.strip().lower()
+        with self._lock:
+            self._check_version()
+            if self._catalog is None:
+                self._catalog = self._load_catalog()
+            if not query:
+                return [row for _, row in self._catalog]
+
+            cached = self._cache.get(query)
+            if cached is not None:
+                self._cache.move_to_end(query)
+                return [row for _, row in cached]
+
+            # Partir del resultado guardado más pequeño cuya consulta esté contenida en la nueva
+            base = self._catalog
+            for previous, results in self._cache.items():
+                if previous in query and len(results) < len(base):
+                    base = results
+
+            results = [entry for entry in base if query in entry[0]]
+            self._cache[query] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return [row for _, row in results]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,100 @@
+import os
+import heapq
+import sqlite3
+
+import manifest
+from db import get_year_invoices, row_sort_key
+from storage import get_storage
+
+# Caché de la última vista (año, filas, selección y desplazamiento) para arrancar sin esperar al disco.
+# Si cambia el formato se sube SNAPSHOT_VERSION y las instantáneas antiguas se descartan.
+SNAPSHOT_DB = "view_cache.db"
+SNAPSHOT_VERSION = 1
+
+
+def year_rows(year, sort="number", descending=True):
+    """
+    Filas de la vista por año con la estructura de get_invoices() (id, number, date, folder, status, name),
+    en el orden pedido (number, name o date). Las facturas del año llegan ordenadas por SQL con el índice
+    por año y se emparejan por carpeta; sólo las carpetas del disco que la BD y el manifiesto aún no
+    conocen se intercalan sin id, sin fecha y como incompletas (como las da de alta reconcile.py).
+    """
+    storage = get_storage()
+    if not storage.has_year(year):
+        return []
+    # Un solo listado del año: la vista muestra sólo las carpetas que existen
+    pending = {manifest.folder_key(os.path.join("data", year, number)): number
+               for number in storage.list_folders(year)}
+
+    rows = []
+    for db_row in get_year_invoices(year, sort, descending):
+        number = pending.pop(manifest.folder_key(db_row[3]), None)
+        if number is not None:
+            rows.append((db_row[0], db_row[1], db_row[2], os.path.join("data", year, number), db_row[4], db_row[5] or ""))
+    if not pending:
+        return rows
+
+    key = lambda row: row_sort_key(row, sort)
+    extra = sorted(((None, number, "", os.path.join("data", year, number), "incompleto", "")
+                    for number in pending.values()), key=key, reverse=descending)
+    return list(heapq.merge(rows, extra, key=key, reverse=descending))
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SNAPSHOT_VERSION:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS view")
+            conn.execute("DROP TABLE IF EXISTS view_rows")
+            conn.execute("CREATE TABLE view (key TEXT PRIMARY KEY, value)")
+            conn.execute("""
+                CREATE TABLE view_rows (
+                    pos INTEGER PRIMARY KEY, id INTEGER, number TEXT, date TEXT,
+                    folder TEXT, status TEXT, name TEXT
+                )
+            """)
+            conn.execute(f"PRAGMA user_version = {SNAPSHOT_VERSION}")
+    return conn
+
+
+def save_snapshot(year, rows, selected_folder=None, scroll=0, sort_order=("number", True), path=SNAPSHOT_DB):
+    """Guarda la vista actual en una sola transacción (rows=None guarda sólo el año)."""
+    conn = _connect(path)
+    with conn:
+        conn.execute("DELETE FROM view")
+        conn.execute("DELETE FROM view_rows")
+        conn.executemany("INSERT INTO view (key, value) VALUES (?, ?)", [
+            ("year", year), ("selected_folder", selected_folder), ("scroll", scroll),
+            ("has_rows", int(rows is not None)), ("sort", sort_order[0]), ("descending", int(sort_order[1])),
+        ])
+        conn.executemany("""
+            INSERT INTO view_rows (pos, id, number, date, folder, status, name) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(pos,) + tuple(row[:6]) for pos, row in enumerate(rows or [])])
+    conn.close()
+
+
+def load_snapshot(path=SNAPSHOT_DB):
+    """
+    Devuelve la última vista guardada como dict (year, rows, selected_folder, scroll, sort, descending),
+    o None si no hay instantánea o es de otra versión.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = _connect(path)
+        view = dict(conn.execute("SELECT key, value FROM view").fetchall())
+        rows = conn.execute("SELECT id, number, date, folder, status, name FROM view_rows ORDER BY pos").fetchall()
+        conn.close()
+    except sqlite3.DatabaseError:
+        return None
+    if "year" not in view:
+        return None
+    return {
+        "year": view["year"],
+        "rows": rows if view.get("has_rows") else None,
+        "selected_folder": view.get("selected_folder"),
+        "scroll": view.get("scroll") or 0,
+        "sort": view.get("sort") or "number",
+        "descending": bool(view.get("descending", 1)),
+    }
@@ -0,0 +1,366 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import argparse
+
+import archive
+
+DATA_DIR = "data"
+BLOB_DB_NAME = "attachments.db"
+CHUNK_SIZE = 256 * 1024
+
+# Backend activo: "folder" (data/<año>/<número>/*.pdf) o "sqlite" (blobs en attachments.db)
+STORAGE_BACKEND = os.environ.get("INVOICE_STORAGE", "folder")
+
+_storage = None
+
+
+def get_storage():
+    """Devuelve la instancia compartida del backend configurado."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def create_storage(backend, **kwargs):
+    if backend == "folder":
+        return FolderStorage(**kwargs)
+    if backend == "sqlite":
+        return BlobStorage(**kwargs)
+    raise ValueError(f"Backend de almacenamiento desconocido: '{backend}'")
+
+
+def _folder_key(folder):
+    return os.path.normpath(folder)
+
+
+def _temp_cache_path(folder, filename):
+    """Ruta en la caché temporal para los PDFs que hay que entregar como archivo."""
+    return os.path.join(tempfile.gettempdir(), "invoice_manager_blobs", _folder_key(folder), filename)
+
+
+class FolderStorage:
+    """
+    Almacenamiento en carpetas: un archivo por PDF en data/<año>/<número>/.
+    Los años archivados (data/<año>.zip) se leen del paquete y son de sólo lectura.
+    """
+
+    name = "folder"
+
+    def put(self, folder, filename, src_path):
+        os.makedirs(folder, exist_ok=True)
+        shutil.copy(src_path, os.path.join(folder, filename))
+
+    def get(self, folder, filename):
+        year, number = archive.archived_year_of(folder)
+        if year is not None:
+            return bytes(archive.open_pack(year).read(number, filename))
+        with open(os.path.join(folder, filename), "rb") as f:
+            return f.read()
+
+    def stream(self, folder, filename, chunk_size=CHUNK_SIZE):
+        if archive.archived_year_of(folder)[0] is not None:
+            data = self.get(folder, filename)
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+            return
+        with open(os.path.join(folder, filename), "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def list(self, folder):
+        """Devuelve [(archivo, tamaño, mtime_ns)] de los PDFs de la carpeta."""
+        year, number = archive.archived_year_of(folder)
+        if year is not None:
+            return archive.open_pack(year).list_files(number)
+        files = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(".pdf"):
+                    st = entry.stat()
+                    files.append((entry.name, st.st_size, st.st_mtime_ns))
+        return files
+
+    def exists(self, folder, filename):
+        year, number = archive.archived_year_of(folder)
+        if year is not None:
+            return filename in archive.open_pack(year).index.get(number, {})
+        return os.path.exists(os.path.join(folder, filename))
+
+    def delete(self, folder, filename):
+        os.remove(os.path.join(folder, filename))
+
+    def create_folder(self, folder):
+        os.makedirs(folder, exist_ok=True)
+
+    def delete_folder(self, folder):
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+
+    def folder_exists(self, folder):
+        year, number = archive.archived_year_of(folder)
+        if year is not None:
+            return number in archive.open_pack(year).index
+        return os.path.isdir(folder)
+
+    def folder_mtime(self, folder):
+        """mtime de la carpeta (o del paquete del año), para validar el manifiesto; None si no existe."""
+        year, _ = archive.archived_year_of(folder)
+        try:
+            return os.stat(archive.pack_path(year) if year else folder).st_mtime_ns
+        except OSError:
+            return None
+
+    def has_year(self, year):
+        return archive.is_archived(year) or os.path.isdir(os.path.join(DATA_DIR, str(year)))
+
+    def list_years(self):
+        """Años con carpeta o paquete en data/."""
+        if not os.path.isdir(DATA_DIR):
+            return []
+        years = set()
+        for name in os.listdir(DATA_DIR):
+            year = name[:-len(archive.PACK_EXT)] if name.endswith(archive.PACK_EXT) else name
+            if year.isdigit() and len(year) == 4:
+                years.add(year)
+        return sorted(years)
+
+    def list_folders(self, year):
+        """Números de factura con carpeta en el año (del índice del paquete si está archivado)."""
+        if archive.is_archived(year):
+            return archive.open_pack(year).numbers()
+        year_folder = os.path.join(DATA_DIR, str(year))
+        if not os.path.isdir(year_folder):
+            return []
+        with os.scandir(year_folder) as it:
+            return [entry.name for entry in it if entry.is_dir()]
+
+    def path(self, folder, filename):
+        """Ruta real en disco del PDF, o None si no se guarda como archivo suelto."""
+        if archive.archived_year_of(folder)[0] is not None:
+            return None
+        return os.path.join(folder, filename)
+
+    def folder_path(self, folder):
+        """Carpeta real en disco, o None (años archivados)."""
+        if archive.archived_year_of(folder)[0] is not None:
+            return None
+        return folder
+
+    def local_path(self, folder, filename):
+        """Ruta de un archivo legible por otros programas (visor PDF.js, visor del sistema)."""
+        return archive.materialize(folder, filename)
+
+
+class BlobStorage:
+    """
+    Almacenamiento de los PDFs como blobs en una base SQLite aparte. Lecturas y escrituras
+    se hacen por bloques con Connection.blobopen, sin cargar el PDF entero en memoria.
+    Todo queda en un único archivo, lo que simplifica las copias de seguridad.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path=BLOB_DB_NAME):
+        self.db_path = db_path
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder TEXT PRIMARY KEY,
+                    year TEXT NOT NULL,
+                    number TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_folders_year ON folders(year)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    folder TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (folder, filename)
+                )
+            """)
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _touch_folder(self, conn, folder):
+        """Crea la carpeta lógica si no existe y actualiza su mtime."""
+        year, number = archive.split_folder(folder)
+        conn.execute("""
+            INSERT INTO folders (folder, year, number, mtime_ns) VALUES (?, ?, ?, ?)
+            ON CONFLICT(folder) DO UPDATE SET mtime_ns=excluded.mtime_ns
+        """, (_folder_key(folder), year or "", number or _folder_key(folder), time.time_ns()))
+
+    def put(self, folder, filename, src_path):
+        size = os.path.getsize(src_path)
+        conn = self._connect()
+        try:
+            with conn:
+                self._touch_folder(conn, folder)
+                cur = conn.execute("""
+                    INSERT OR REPLACE INTO files (folder, filename, size, mtime_ns, data)
+                    VALUES (?, ?, ?, ?, zeroblob(?))
+                """, (_folder_key(folder), filename, size, time.time_ns(), size))
+                rowid = cur.lastrowid
+                with conn.blobopen("files", "data", rowid) as blob, open(src_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        blob.write(chunk)
+        finally:
+            conn.close()
+
+    def _rowid(self, conn, folder, filename):
+        row = conn.execute("SELECT rowid FROM files WHERE folder=? AND filename=?",
+                           (_folder_key(folder), filename)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"{filename} no está en {folder}")
+        return row[0]
+
+    def get(self, folder, filename):
+        return b"".join(self.stream(folder, filename))
+
+    def stream(self, folder, filename, chunk_size=CHUNK_SIZE):
+        conn = self._connect()
+        try:
+            rowid = self._rowid(conn, folder, filename)
+            with conn.blobopen("files", "data", rowid, readonly=True) as blob:
+                for chunk in iter(lambda: blob.read(chunk_size), b""):
+                    yield chunk
+        finally:
+            conn.close()
+
+    def list(self, folder):
+        conn = self._connect()
+        rows = conn.execute("SELECT filename, size, mtime_ns FROM files WHERE folder=?",
+                            (_folder_key(folder),)).fetchall()
+        conn.close()
+        return rows
+
+    def exists(self, folder, filename):
+        conn = self._connect()
+        row = conn.execute("SELECT 1 FROM files WHERE folder=? AND filename=?",
+                           (_folder_key(folder), filename)).fetchone()
+        conn.close()
+        return row is not None
+
+    def delete(self, folder, filename):
+        conn = self._connect()
+        with conn:
+            cur = conn.execute("DELETE FROM files WHERE folder=? AND filename=?",
+                               (_folder_key(folder), filename))
+            if cur.rowcount == 0:
+                raise FileNotFoundError(f"{filename} no está en {folder}")
+            self._touch_folder(conn, folder)
+        conn.close()
+
+    def create_folder(self, folder):
+        conn = self._connect()
+        with conn:
+            self._touch_folder(conn, folder)
+        conn.close()
+
+    def delete_folder(self, folder):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM files WHERE folder=?", (_folder_key(folder),))
+            conn.execute("DELETE FROM folders WHERE folder=?", (_folder_key(folder),))
+        conn.close()
+
+    def folder_exists(self, folder):
+        return self.folder_mtime(folder) is not None
+
+    def folder_mtime(self, folder):
+        conn = self._connect()
+        row = conn.execute("SELECT mtime_ns FROM folders WHERE folder=?", (_folder_key(folder),)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def has_year(self, year):
+        conn = self._connect()
+        row = conn.execute("SELECT 1 FROM folders WHERE year=? LIMIT 1", (str(year),)).fetchone()
+        conn.close()
+        return row is not None
+
+    def list_years(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT DISTINCT year FROM folders WHERE year != '' ORDER BY year").fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+    def list_folders(self, year):
+        conn = self._connect()
+        rows = conn.execute("SELECT number FROM folders WHERE year=?", (str(year),)).fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+    def path(self, folder, filename):
+        return None
+
+    def folder_path(self, folder):
+        return None
+
+    def local_path(self, folder, filename):
+        path = _temp_cache_path(folder, filename)
+        conn = self._connect()
+        row = conn.execute("SELECT size, mtime_ns FROM files WHERE folder=? AND filename=?",
+                           (_folder_key(folder), filename)).fetchone()
+        conn.close()
+        if row is None:
+            raise FileNotFoundError(f"{filename} no está en {folder}")
+        size, mtime_ns = row
+        # Reutilizar la copia temporal si sigue siendo la misma versión del blob
+        try:
+            st = os.stat(path)
+            if st.st_size == size and st.st_mtime_ns >= mtime_ns:
+                return path
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            for chunk in self.stream(folder, filename):
+                f.write(chunk)
+        return path
+
+
+def migrate(source, target, progress=None):
+    """Copia todas las carpetas y PDFs de un backend a otro (por ejemplo folder -> sqlite)."""
+    count = 0
+    for year in source.list_years():
+        for number in source.list_folders(year):
+            folder = os.path.join(DATA_DIR, year, number)
+            target.create_folder(folder)
+            for filename, _, _ in source.list(folder):
+                src_path = source.local_path(folder, filename)
+                target.put(folder, filename, src_path)
+                count += 1
+                if progress:
+                    progress(count)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Herramientas del almacenamiento de PDFs.")
+    parser.add_argument("action", choices=("migrate",))
+    parser.add_argument("source", choices=("folder", "sqlite"))
+    parser.add_argument("target", choices=("folder", "sqlite"))
+    args = parser.parse_args(argv)
+    if args.source == args.target:
+        parser.error("El origen y el destino deben ser distintos")
+    count = migrate(create_storage(args.source), create_storage(args.target))
+    print(f"{count} PDFs copiados de '{args.source}' a '{args.target}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
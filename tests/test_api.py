@@ -0,0 +1,126 @@
+import os
+import json
+import socket
+import asyncio
+import tempfile
+import threading
+import unittest
+import http.client
+
+import api
+import storage
+from db import init_db, add_invoice
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 8 + b"\n%%EOF\n"
+
+
+class InvoiceAPITest(unittest.TestCase):
+    """Prueba la API contra un servidor real en localhost, con la BD y data/ en una carpeta temporal."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        storage._storage = None
+        init_db()
+        os.makedirs(os.path.join("data", "2025", "F-1"))
+        with open(os.path.join("data", "2025", "F-1", "invoice.pdf"), "wb") as f:
+            f.write(PDF)
+        add_invoice("F-1", "Acme", "2025-03-01", "data/2025/F-1", "completo")
+        add_invoice("F-2", "Globex", "2025-04-01", "data/2025/F-2", "incompleto")
+
+        self.loop = asyncio.new_event_loop()
+        self.api = api.InvoiceAPI(max_workers=2)
+        server = self.loop.run_until_complete(self.api.start("127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.run_until_complete(self.api.close())
+        self.loop.close()
+        storage._storage = None
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def request(self, method, path, headers=None, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    def raw_request(self, data):
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(data)
+            chunks = []
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    def test_list_invoices(self):
+        status, _, body = self.request("GET", "/invoices?status=completo")
+        data = json.loads(body)
+        self.assertEqual(status, 200)
+        self.assertEqual(data["total"], 1)
+        self.assertEqual([item["number"] for item in data["items"]], ["F-1"])
+
+        _, _, body = self.request("GET", "/invoices?per_page=1&page=2")
+        data = json.loads(body)
+        self.assertEqual((data["total"], len(data["items"])), (2, 1))
+
+    def test_pdf_etag_and_not_modified(self):
+        status, headers, body = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, PDF)
+        etag = headers["ETag"]
+
+        status, _, body = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf", {"If-None-Match": etag})
+        self.assertEqual((status, body), (304, b""))
+
+    def test_pdf_range(self):
+        status, headers, body = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf", {"Range": "bytes=10-19"})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, PDF[10:20])
+        self.assertEqual(headers["Content-Range"], f"bytes 10-19/{len(PDF)}")
+
+        status, _, body = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf", {"Range": "bytes=-5"})
+        self.assertEqual((status, body), (206, PDF[-5:]))
+
+        status, headers, _ = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf",
+                                          {"Range": f"bytes={len(PDF)}-"})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers["Content-Range"], f"bytes */{len(PDF)}")
+
+        # If-Range con otra versión: se envía el archivo completo
+        status, _, body = self.request("GET", "/invoices/F-1/pdfs/invoice.pdf",
+                                       {"Range": "bytes=0-3", "If-Range": '"old"'})
+        self.assertEqual((status, body), (200, PDF))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.request("GET", "/invoices?page=x")[0], 400)
+        self.assertEqual(self.request("GET", "/invoices/NOPE")[0], 404)
+        self.assertEqual(self.request("GET", "/invoices/F-1/pdfs/missing.pdf")[0], 404)
+        self.assertEqual(self.request("DELETE", "/invoices/F-1/status")[0], 405)
+        self.assertEqual(self.request("PUT", "/invoices/F-1/status", body=b"not json")[0], 400)
+        self.assertEqual(self.request("PUT", "/invoices/F-1/status", body=b'{"status": "x"}')[0], 400)
+        self.assertTrue(self.raw_request(b"GARBAGE\r\n\r\n").startswith(b"HTTP/1.1 400"))
+        for length in (b"abc", b"-1"):
+            response = self.raw_request(b"PUT /invoices/F-1/status HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n")
+            self.assertTrue(response.startswith(b"HTTP/1.1 400"), response)
+
+    def test_set_status(self):
+        status, _, body = self.request("PUT", "/invoices/F-2/status", body=b'{"status": "completo"}')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["status"], "completo")
+
+
+if __name__ == "__main__":
+    unittest.main()
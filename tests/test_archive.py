@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+import archive
+
+
+class PackYearTest(unittest.TestCase):
+    """pack_year() no debe borrar nada que no haya quedado dentro del paquete."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.write("data/2023/A1/invoice.pdf", b"%PDF-1.4 A1")
+        self.write("data/2023/A2/Scan.PDF", b"%PDF-1.4 A2")
+        os.makedirs("data/2023/A3")
+
+    def tearDown(self):
+        archive.close_pack("2023")
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_pack_and_remove(self):
+        self.assertEqual(archive.pack_year("2023"), 2)
+        self.assertFalse(os.path.exists("data/2023"))
+        self.assertTrue(archive.is_archived("2023"))
+        reader = archive.open_pack("2023")
+        self.assertEqual(sorted(reader.numbers()), ["A1", "A2", "A3"])
+        self.assertEqual(reader.read("A1", "invoice.pdf"), b"%PDF-1.4 A1")
+
+    def test_refuses_when_folders_hold_other_files(self):
+        extras = ["data/2023/A1/notes.txt", "data/2023/A1/sub/scan.pdf", "data/2023/readme.txt"]
+        for path in extras:
+            self.write(path, b"keep me")
+        with self.assertRaises(ValueError) as ctx:
+            archive.pack_year("2023")
+        for path in ("A1/notes.txt", "A1/sub/", "A1/sub/scan.pdf", "readme.txt"):
+            self.assertIn(path, str(ctx.exception))
+        for path in extras:
+            self.assertTrue(os.path.exists(path), path)
+        self.assertFalse(os.path.exists(archive.pack_path("2023")))
+
+    def test_keep_packs_pdfs_only(self):
+        self.write("data/2023/A1/notes.txt", b"keep me")
+        self.assertEqual(archive.pack_year("2023", remove_folders=False), 2)
+        self.assertTrue(os.path.exists("data/2023/A1/notes.txt"))
+        with zipfile.ZipFile(archive.pack_path("2023")) as zf:
+            self.assertNotIn("A1/notes.txt", zf.namelist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import backup
+
+
+class BackupTest(unittest.TestCase):
+    """Copia, comprobación y restauración de invoices.db y data/."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        conn = sqlite3.connect("invoices.db")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE invoices (id INTEGER PRIMARY KEY, number TEXT)")
+        conn.execute("INSERT INTO invoices (number) VALUES ('A1')")
+        conn.commit()
+        conn.close()
+        self.write("data/2023/A1/invoice.pdf", b"%PDF-1.4 A1")
+        self.write("data/2023/A2/scan.pdf", b"%PDF-1.4 A2")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def read(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_create_and_incremental(self):
+        first, copied, linked = backup.run_backup()
+        self.assertEqual((copied, linked), (2, 0))
+        self.assertEqual(backup.list_backups(), [first])
+        self.assertEqual(sorted(backup.load_manifest(first)["files"]), ["2023/A1/invoice.pdf", "2023/A2/scan.pdf"])
+
+        self.write("data/2023/A3/new.pdf", b"%PDF-1.4 A3")
+        second, copied, linked = backup.run_backup()
+        self.assertEqual((copied, linked), (1, 2))
+        self.assertEqual(backup.list_backups(), [first, second])
+        self.assertEqual(os.stat(os.path.join(first, "data", "2023", "A1", "invoice.pdf")).st_ino,
+                         os.stat(os.path.join(second, "data", "2023", "A1", "invoice.pdf")).st_ino)
+
+    def test_copy_is_standalone(self):
+        path, _, _ = backup.run_backup()
+        copy = os.path.join(path, "invoices.db")
+        # Bytes 18 y 19 de la cabecera: 1 con diario clásico, 2 con WAL
+        self.assertEqual(self.read(copy)[18:20], b"\x01\x01")
+        conn = sqlite3.connect(copy)
+        self.assertEqual(conn.execute("SELECT number FROM invoices").fetchall(), [("A1",)])
+        conn.close()
+        self.assertFalse(os.path.exists(copy + "-wal"))
+
+    def test_verify(self):
+        path, _, _ = backup.run_backup()
+        self.assertEqual(backup.verify_backup(path), [])
+        self.assertEqual(sorted(os.listdir(path)), ["backup_manifest.json", "data", "invoices.db"])
+
+        self.write(os.path.join(path, "data", "2023", "A2", "scan.pdf"), b"%PDF-1.4 XX")
+        os.remove(os.path.join(path, "data", "2023", "A1", "invoice.pdf"))
+        self.assertEqual(backup.verify_backup(path),
+                         ["data/2023/A1/invoice.pdf: falta", "data/2023/A2/scan.pdf: contenido distinto"])
+
+    def test_restore(self):
+        path, _, _ = backup.run_backup()
+        self.write("data/2023/A1/invoice.pdf", b"%PDF-1.4 changed")
+        os.remove("data/2023/A2/scan.pdf")
+        self.write("data/2023/A9/other.pdf", b"%PDF-1.4 A9")
+        conn = sqlite3.connect("invoices.db")
+        conn.execute("DELETE FROM invoices")
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(backup.restore_backup(path), (2, 0))
+        self.assertEqual(self.read("data/2023/A1/invoice.pdf"), b"%PDF-1.4 A1")
+        self.assertEqual(self.read("data/2023/A2/scan.pdf"), b"%PDF-1.4 A2")
+        self.assertTrue(os.path.exists("data/2023/A9/other.pdf"))
+        conn = sqlite3.connect("invoices.db")
+        self.assertEqual(conn.execute("SELECT number FROM invoices").fetchall(), [("A1",)])
+        conn.close()
+
+    def test_restore_prune(self):
+        path, _, _ = backup.run_backup()
+        self.write("data/2023/A9/other.pdf", b"%PDF-1.4 A9")
+        self.assertEqual(backup.restore_backup(path, prune=True), (0, 1))
+        self.assertFalse(os.path.exists("data/2023/A9/other.pdf"))
+        self.assertTrue(os.path.exists("data/2023/A1/invoice.pdf"))
+
+
+if __name__ == "__main__":
+    unittest.main()